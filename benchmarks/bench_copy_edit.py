@@ -0,0 +1,262 @@
+# Benchmarks for CopyEdit's copy, cut, paste and paste history, run against the
+# headless stand-in of the Sublime API (see headless/):
+#
+#     python benchmarks/bench_copy_edit.py          # quick sweep, compared with baselines.json
+#     python benchmarks/bench_copy_edit.py --full   # up to 100k cursors and 256 MiB payloads
+#     python benchmarks/bench_copy_edit.py --save   # store the results as the new baselines
+#
+# Each scenario is a distribution shape, a cursor count, a payload size (the
+# total number of characters copied) and a line ending. Latency is the median
+# of --repeat runs; peak memory is measured with tracemalloc in a separate run.
+# The exit status is 1 when some result is slower (or uses more memory) than
+# its baseline by more than --tolerance, beyond a noise floor of 2 ms or 10%
+# of the baseline. A result over the tolerance is measured again up to
+# --confirm times, keeping the fastest median, so that a moment of load on the
+# machine isn't reported as a regression. Traces recorded with the
+# copy_edit_trace setting and put in traces/ are benchmarked too, one
+# scenario per operation.
+
+import os, sys, time, json, argparse, tracemalloc
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, "headless"), root]
+
+import sublime, copy_edit, replay_trace
+
+QUICK = {
+	"cursors": [1, 100, 10000],
+	"payloads": [1 << 10, 1 << 20],
+	"line_endings": ["Unix", "Windows", "CR"],
+}
+FULL = {
+	"cursors": [1, 10, 100, 1000, 10000, 100000],
+	"payloads": [16, 1 << 10, 1 << 20, 16 << 20, 256 << 20],
+	"line_endings": ["Unix", "Windows", "CR"],
+}
+MAX_BUFFER = 512 << 20 # scenarios that would grow the buffer beyond this are skipped
+K = 4 # strings per caret in the n_to_n_k shape
+
+# Shapes: functions of (cursors, segment length) returning the buffer text, the
+# regions to copy (or cut) and the regions to paste onto, or None if the
+# shape doesn't apply.
+
+def lines(n, seg):
+	return "".join("x" * seg + "\n" for _ in range(n))
+
+def line_regions(n, seg, caret = False):
+	step = seg + 1
+	return [(i * step + seg, i * step + seg) if caret else (i * step, i * step + seg) for i in range(n)]
+
+def n_to_n(n, seg):
+	return lines(n, seg), line_regions(n, seg), line_regions(n, seg, True)
+
+def one_to_n(n, seg):
+	return lines(1, seg) + lines(n, 1), line_regions(1, seg), [(seg + 1 + i * 2 + 1,) * 2 for i in range(n)]
+
+def n_to_n_k(n, seg):
+	if n < K:
+		return None
+	return lines(n, seg), line_regions(n, seg), line_regions(n // K, seg, True)
+
+def char_split(n, seg): # test (10): one string pasted onto n one-character selections
+	text = lines(1, seg) + "y" * n + "\n"
+	return text, line_regions(1, seg), [(seg + 1 + i, seg + 2 + i) for i in range(n)]
+
+def whole_line(n, seg): # copy with empty selections copies whole lines
+	carets = line_regions(n, seg, True)
+	return lines(n, seg), carets, carets
+
+SHAPES = [
+	("n_to_n", n_to_n),
+	("1_to_n", one_to_n),
+	("n_to_n_k", n_to_n_k),
+	("char_split", char_split),
+	("whole_line", whole_line),
+]
+
+def reset():
+	sublime.reset()
+	copy_edit.selection_strings[:] = []
+	copy_edit.paste_history.clear()
+	copy_edit.clipboard_fingerprint = None
+	copy_edit.clipboard_key = None
+
+def new_view(text, regions, line_ending):
+	view = sublime.active_window().new_file()
+	view.set_line_endings(line_ending)
+	view.run_command("append", {"characters": text})
+	view.substr(0) # apply the edit now rather than inside the measurement
+	select(view, regions)
+	return view
+
+def select(view, regions):
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(a, b) for a, b in regions])
+
+def copy_paste_ops(text, copy_regions, paste_regions, line_ending):
+	# Returns {op: callable}; every call starts from the same state.
+	def copy():
+		reset()
+		view = new_view(text, copy_regions, line_ending)
+		return lambda: view.run_command("copy_edit")
+	def cut():
+		reset()
+		view = new_view(text, copy_regions, line_ending)
+		return lambda: (view.run_command("cut_edit"), view.substr(0))
+	def paste():
+		reset()
+		view = new_view(text, copy_regions, line_ending)
+		view.run_command("copy_edit")
+		select(view, paste_regions)
+		return lambda: (view.run_command("paste_edit"), sublime.run_timeouts(), view.substr(0)) # finish a chunked paste; substr makes the buffer apply the edits
+	return {"copy": copy, "cut": cut, "paste": paste}
+
+def history_ops(payload):
+	strings = [chr(ord("a") + i) * payload for i in range(15)]
+	def add():
+		reset()
+		for s in strings[1:]:
+			copy_edit.add_string_to_paste_history(s)
+		new = strings[0]
+		return lambda: copy_edit.add_string_to_paste_history(new)
+	def readd():
+		reset()
+		for s in strings:
+			copy_edit.add_string_to_paste_history(s)
+		again = "".join([strings[-1][:1], strings[-1][1:]]) # equal, but a different object
+		return lambda: copy_edit.add_string_to_paste_history(again)
+	return {"history_add": add, "history_readd": readd}
+
+def trace_scenarios(pattern):
+	# Every operation of the traces in traces/ (see replay_trace.py).
+	directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces")
+	if not os.path.isdir(directory):
+		return
+	for name in sorted(os.listdir(directory)):
+		if not name.endswith(".jsonl"):
+			continue
+		texts = {}
+		for i, entry in enumerate(replay_trace.load(os.path.join(directory, name))):
+			if entry["op"] not in replay_trace.commands:
+				continue
+			key = "trace/{0}/{1}/{2}".format(name[:-len(".jsonl")], i, entry["op"])
+			known = dict(texts)
+			replay_trace.buffer_text(entry, texts)
+			if pattern in key:
+				yield key, lambda entry = entry, known = known: (reset(), replay_trace.setup(entry, known)[0])[1]
+
+def scenarios(sweep, pattern):
+	for key, setup in trace_scenarios(pattern):
+		yield key, setup
+	for payload in sweep["payloads"]:
+		key = "history/{0}".format(payload)
+		for op, setup in sorted(history_ops(payload).items()):
+			if pattern in key + "/" + op:
+				yield key + "/" + op, setup
+	for name, shape in SHAPES:
+		for n in sweep["cursors"]:
+			for payload in sweep["payloads"]:
+				seg = max(1, payload // n)
+				if name in ("1_to_n", "char_split"):
+					seg = payload
+				if seg * n * 3 > MAX_BUFFER:
+					continue
+				for line_ending in sweep["line_endings"]:
+					key = "{0}/{1}/{2}/{3}".format(name, n, payload, line_ending)
+					if pattern not in key:
+						continue
+					layout = shape(n, seg)
+					if layout is None:
+						continue
+					for op, setup in sorted(copy_paste_ops(*layout + (line_ending,)).items()):
+						if pattern in key + "/" + op:
+							yield key + "/" + op, setup
+
+def measure(setup, repeat, memory):
+	times = []
+	for _ in range(max(repeat, 1)):
+		run = setup()
+		start = time.perf_counter()
+		run()
+		times.append(time.perf_counter() - start)
+	times.sort()
+	median = times[len(times) // 2] if len(times) % 2 else (times[len(times) // 2 - 1] + times[len(times) // 2]) / 2
+	peak = None
+	if memory:
+		run = setup()
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+		run()
+		peak = tracemalloc.get_traced_memory()[1] - before
+		tracemalloc.stop()
+	reset()
+	return {"seconds": median, "peak_bytes": peak}
+
+def compare(result, baseline, tolerance):
+	# Returns the ratios to the baseline and whether any of them is a regression.
+	ratios = {}
+	regressed = False
+	for field, floor, relative in (("seconds", 0.002, 0.1), ("peak_bytes", 64 << 10, 0)):
+		if result.get(field) is None or baseline.get(field) is None:
+			continue
+		noise = max(floor, baseline[field] * relative)
+		ratios[field] = (result[field] + noise) / (baseline[field] + noise) # ignore differences below the noise floor
+		regressed = regressed or ratios[field] > tolerance
+	return ratios, regressed
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "CopyEdit benchmarks")
+	parser.add_argument("--full", action = "store_true", help = "run the full sweep instead of the quick one")
+	parser.add_argument("--filter", default = "", help = "only run scenarios whose key contains this")
+	parser.add_argument("--repeat", type = int, default = 5)
+	parser.add_argument("--confirm", type = int, default = 2, help = "times to measure a result over the tolerance again")
+	parser.add_argument("--no-memory", action = "store_true", help = "don't measure peak memory")
+	parser.add_argument("--baselines", default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json"))
+	parser.add_argument("--save", action = "store_true", help = "write the results to the baselines file")
+	parser.add_argument("--tolerance", type = float, default = 1.5, help = "allowed ratio to the baseline")
+	args = parser.parse_args(argv)
+
+	try:
+		with open(args.baselines) as f:
+			baselines = json.load(f)
+	except (IOError, OSError, ValueError):
+		baselines = {}
+
+	results = {}
+	regressions = []
+	for key, setup in scenarios(FULL if args.full else QUICK, args.filter):
+		result = results[key] = measure(setup, args.repeat, not args.no_memory)
+		compared = key in baselines and not args.save
+		if compared:
+			ratios, regressed = compare(result, baselines[key], args.tolerance)
+			for _ in range(args.confirm):
+				if not regressed or ratios.get("peak_bytes", 0) > args.tolerance: # memory doesn't vary from run to run
+					break
+				result["seconds"] = min(result["seconds"], measure(setup, args.repeat, False)["seconds"])
+				ratios, regressed = compare(result, baselines[key], args.tolerance)
+		line = "{0:<44} {1:>10.3f} ms".format(key, result["seconds"] * 1000)
+		if result["peak_bytes"] is not None:
+			line += " {0:>10.2f} MiB".format(result["peak_bytes"] / float(1 << 20))
+		if compared:
+			line += "  " + " ".join("{0} x{1:.2f}".format("time" if field == "seconds" else "mem", ratio) for field, ratio in sorted(ratios.items(), reverse = True))
+			if regressed:
+				line += "  REGRESSION"
+				regressions.append(key)
+		print(line)
+		sys.stdout.flush()
+
+	if args.save:
+		baselines.update(results)
+		with open(args.baselines, "w") as f:
+			json.dump(baselines, f, indent = 1, sort_keys = True)
+			f.write("\n")
+		print("saved {0} results to {1}".format(len(results), args.baselines))
+	elif regressions:
+		print("{0} regression(s):".format(len(regressions)))
+		for key in regressions:
+			print("  " + key)
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,139 @@
+# Replays a trace recorded with the copy_edit_trace setting against the
+# headless stand-in of the Sublime API (see headless/):
+#
+#     python benchmarks/replay_trace.py trace.jsonl             # replay, compare with the recorded times
+#     python benchmarks/replay_trace.py trace.jsonl --repeat 5
+#
+# Every operation runs on a fresh view made to look like the recorded one:
+# the recorded buffer text if the trace has it, otherwise a buffer of the
+# same size with line breaks where the selections' lines start and end, and
+# copied strings of the recorded lengths. Traces put in benchmarks/traces/
+# are also replayed by bench_copy_edit.py, as regression benchmarks.
+
+import os, sys, time, json, argparse, collections
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, "headless"), root]
+
+import sublime, copy_edit
+
+commands = {
+	"copy": "copy_edit",
+	"cut": "cut_edit",
+	"paste": "paste_edit",
+	"paste_from_history": "paste_from_history_idx",
+	"paste_template": "paste_template_edit",
+}
+
+def load(path):
+	with open(path) as f:
+		return [json.loads(line) for line in f if line.strip()]
+
+def regions_of(entry):
+	# The selections and the (line start, line end) around each of them.
+	regions = []
+	lines = []
+	pos = 0
+	sel = entry["sel"]
+	for i in range(0, len(sel), 4):
+		gap, length, before, after = sel[i:i + 4]
+		begin = pos + gap
+		pos = begin + length
+		regions.append((begin, pos))
+		lines.append((begin - before, pos + after))
+	return regions, lines
+
+def buffer_text(entry, texts):
+	if "text" in entry:
+		texts[entry["view"]] = entry["text"]
+	text = texts.get(entry["view"])
+	if text is not None and len(text) == entry["size"]:
+		return text
+	regions, lines = regions_of(entry)
+	chars = bytearray(b"x" * entry["size"])
+	for line_start, line_end in lines:
+		if line_start > 0:
+			chars[line_start - 1:line_start] = b"\n"
+		if line_end < entry["size"]:
+			chars[line_end:line_end + 1] = b"\n"
+	return chars.decode("ascii")
+
+def copied_strings(entry):
+	if "strings" in entry:
+		texts = entry["strings"]
+	else:
+		texts = ["y" * n for n in entry["seg"]]
+	whole_lines = set(entry["wl"])
+	return [(text[:-1] + "\n" if i in whole_lines and text else text, i in whole_lines) for i, text in enumerate(texts)]
+
+def setup(entry, texts):
+	# Returns a callable running the entry's operation on a view like the recorded one.
+	view = sublime.active_window().new_file()
+	view.set_line_endings(entry["le"])
+	view.run_command("append", {"characters": buffer_text(entry, texts)})
+	view.substr(0) # apply the edit now rather than inside the measurement
+	view.sel().add_all([sublime.Region(begin, end) for begin, end in regions_of(entry)[0]])
+	if entry["op"] in ("paste", "paste_template") and entry["seg"]:
+		strings = copied_strings(entry)
+		copy_edit.selection_strings[:] = strings
+		sublime.set_clipboard(copy_edit.remember_clipboard(copy_edit.clipboard_text(strings, "\n"), strings))
+	elif entry["op"] == "paste_from_history" and entry["seg"]:
+		# put what was pasted at the recorded position in paste history
+		strings = copied_strings(entry)
+		copy_edit.selection_strings[:] = strings
+		copy_edit.remember_clipboard(copy_edit.clipboard_text(strings, "\n"), strings)
+		for i in range(entry["args"].get("idx", 0)):
+			copy_edit.add_string_to_paste_history("\0{0}".format(i))
+	args = dict(entry["args"])
+	if entry["op"] == "paste_template":
+		args.setdefault("template", "{text}") # not recorded without copy_edit_trace_text
+	def run():
+		view.run_command(commands[entry["op"]], args)
+		sublime.run_timeouts()
+		view.substr(0)
+	return run, view
+
+def replay(entries, repeat = 1):
+	# Returns {op: [recorded ms, replayed ms, count]} and the replayed ms of each entry.
+	totals = collections.OrderedDict()
+	times = []
+	texts = {}
+	for entry in entries:
+		if entry["op"] not in commands:
+			continue
+		best = None
+		for _ in range(repeat):
+			run, view = setup(entry, dict(texts))
+			start = time.perf_counter()
+			run()
+			elapsed = (time.perf_counter() - start) * 1000
+			best = elapsed if best is None else min(best, elapsed)
+			view.close()
+		buffer_text(entry, texts) # remember the recorded text for the next entries
+		times.append(best)
+		total = totals.setdefault(entry["op"], [0.0, 0.0, 0])
+		total[0] += entry.get("ms", 0)
+		total[1] += best
+		total[2] += 1
+	return totals, times
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "Replay a CopyEdit trace headlessly")
+	parser.add_argument("trace")
+	parser.add_argument("--repeat", type = int, default = 1)
+	parser.add_argument("--slowest", type = int, default = 5, help = "list this many of the slowest operations")
+	args = parser.parse_args(argv)
+
+	entries = [e for e in load(args.trace) if e["op"] in commands]
+	totals, times = replay(entries, args.repeat)
+	print("{0:<20} {1:>7} {2:>14} {3:>14}".format("operation", "count", "recorded ms", "replayed ms"))
+	for op, (recorded, replayed, count) in totals.items():
+		print("{0:<20} {1:>7} {2:>14.1f} {3:>14.1f}".format(op, count, recorded, replayed))
+	for ms, i in sorted(((ms, i) for i, ms in enumerate(times)), reverse = True)[:args.slowest]:
+		entry = entries[i]
+		print("{0:>10.1f} ms  #{1} {2}: {3} selections, {4} characters in the buffer, {5} strings".format(
+			ms, i, entry["op"], len(entry["sel"]) // 4, entry["size"], len(entry["seg"])))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,6 +1,132 @@
-import sublime, sublime_plugin, collections
+import sublime, sublime_plugin, collections, itertools, hashlib, zlib, tempfile, os, sys, struct, threading, time, functools, bisect, re, array, io, json, mmap, codecs
 
-selection_strings = []
+try:
+	import fcntl
+except ImportError: # Windows
+	fcntl = None
+	import msvcrt
+
+class SelectionStrings(object):
+	# The (text, whole_line) strings of the last copy, one per selection,
+	# stored compactly: every distinct string once, and the sequence as runs
+	# of the same string, so that 100k carets copying a handful of different
+	# tokens keep a handful of strings alive. When runs are mostly of one
+	# string, the sequence is an array of indices into the distinct strings
+	# instead, and when no string repeats, the distinct strings are the
+	# sequence. It reads like a list.
+	def __init__(self, strings = ()):
+		self.clear()
+		self.extend(strings)
+
+	def clear(self):
+		self.unique = []     # distinct strings
+		self.indices = None  # index in unique of each string, or
+		self.runs = None     # index in unique of the string of each run
+		self.ends = None     # and index in the sequence after each run
+		self.length = 0
+		self.chars = 0       # total number of characters
+		self.bytes = 0       # memory held by the distinct strings' texts, for instrumentation
+		self.run = 0         # run of the last item looked up, to read items in order cheaply
+
+	def append(self, string):
+		self.extend((string,))
+
+	def extend(self, strings):
+		unique = self.unique
+		ids = dict(zip(unique, range(len(unique)))) # string -> its index in unique, only while extending
+		indices = self.index_array()
+		for string in strings:
+			i = ids.get(string)
+			if i is None:
+				i = ids[string] = len(unique)
+				unique.append(string)
+				self.bytes += sys.getsizeof(string[0])
+			indices.append(i)
+			self.chars += len(string[0])
+		self.store(indices)
+
+	def index_array(self): # a new array of the index in unique of every string
+		if self.indices is not None:
+			return self.indices
+		if self.runs is None:
+			return array.array("L", range(len(self.unique)))
+		indices = array.array("L")
+		start = 0
+		for i, end in zip(self.runs, self.ends):
+			indices.extend(array.array("L", [i]) * (end - start))
+			start = end
+		return indices
+
+	def store(self, indices): # in the most compact of the three forms
+		self.length = len(indices)
+		self.indices = self.runs = self.ends = None
+		self.run = 0
+		if len(self.unique) == self.length:
+			return
+		runs = array.array("L")
+		ends = array.array("L")
+		for j, i in enumerate(indices):
+			if not runs or i != runs[-1]:
+				if (len(runs) + 1) * 2 > self.length: # runs too short to pay for their ends
+					self.indices = indices
+					return
+				if runs:
+					ends.append(j)
+				runs.append(i)
+		ends.append(self.length)
+		self.runs, self.ends = runs, ends
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		if self.indices is not None:
+			for i in self.indices:
+				yield self.unique[i]
+		elif self.runs is None:
+			for string in self.unique:
+				yield string
+		else:
+			start = 0
+			for i, end in zip(self.runs, self.ends):
+				string = self.unique[i]
+				for _ in range(end - start):
+					yield string
+				start = end
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError(index)
+		if self.indices is not None:
+			return self.unique[self.indices[index]]
+		if self.runs is None:
+			return self.unique[index]
+		j = self.run
+		if j >= len(self.ends) or not (self.ends[j - 1] if j else 0) <= index < self.ends[j]:
+			j = self.run = bisect.bisect_right(self.ends, index)
+		return self.unique[self.runs[j]]
+
+	def __setitem__(self, index, strings): # only `selection_strings[:] = strings`
+		if index != slice(None):
+			raise TypeError("SelectionStrings only supports replacing all items")
+		strings = list(strings) if strings is self else strings
+		self.clear()
+		self.extend(strings)
+
+	def __eq__(self, other):
+		return list(self) == list(other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return "SelectionStrings({0!r})".format(list(self))
+
+selection_strings = SelectionStrings()
 
 line_endings = {'CR': '\r', 'Unix': '\n', 'Windows': '\r\n'}
 
@@ -14,138 +140,1794 @@ line_endings = {'CR': '\r', 'Unix': '\n', 'Windows': '\r\n'}
 #always copy empty lines. I don't understand the copying empty lines in the
 #first place, but I would rather be internally consistent.
 
-def print_status_message(verb, numregions=None):
-	numregions = numregions or len(selection_strings)
-	numchars = sum([len(s[0]) for s in selection_strings])
+def status_text(verb, numregions=None, strings=None, numchars=None):
+	strings = selection_strings if strings is None else strings
+	numregions = numregions or len(strings)
+	numchars = strings.chars if numchars is None else numchars
 	message = "{0} {1} character{2}".format(verb, numchars, 's' if numchars != 1 else '')
 	if numregions > 1:
 		message += " over {0} selection regions".format(numregions)
-	sublime.status_message(message)
+	return message
+
+def print_status_message(verb, numregions=None, strings=None):
+	sublime.status_message(status_text(verb, numregions, strings))
+
+def preference(name, default):
+	return sublime.load_settings("Preferences.sublime-settings").get(name, default)
+
+#A note about instrumentation
+#----------------------------
+#With the copy_edit_instrumentation setting on, the commands, paste history
+#inserts and the listener record their wall time, the number of view API
+#calls they made, the characters they handled and the memory held by
+#selection_strings and paste history afterwards. copy_edit_stats prints the
+#totals, and anything slower than copy_edit_slow_ms is printed right away.
+
+class CountingSelection(object):
+	def __init__(self, sel, counter):
+		self.sel = sel
+		self.counter = counter
+
+	def __len__(self):
+		self.counter.calls += 1
+		return len(self.sel)
+
+	def __getitem__(self, index):
+		self.counter.calls += 1
+		return self.sel[index]
+
+	def __iter__(self):
+		for region in self.sel:
+			self.counter.calls += 1
+			yield region
+
+	def __getattr__(self, name):
+		self.counter.calls += 1
+		return getattr(self.sel, name)
+
+class CountingView(object):
+	# Stands in for a view while an instrumented command runs.
+	def __init__(self, view):
+		self.view = view
+		self.calls = 0
+
+	def __getattr__(self, name):
+		attr = getattr(self.view, name)
+		if not callable(attr):
+			return attr
+		def call(*args, **kwargs):
+			self.calls += 1
+			result = attr(*args, **kwargs)
+			return CountingSelection(result, self) if name == "sel" else result
+		return call
+
+class Stats(object):
+	fields = ("count", "seconds", "max_seconds", "api_calls", "characters", "held_bytes")
+
+	def __init__(self):
+		self.ops = collections.OrderedDict() # operation -> {field: value}
+
+	def record(self, op, seconds, api_calls, characters):
+		held = selection_strings.bytes + paste_history.bytes
+		totals = self.ops.setdefault(op, dict.fromkeys(self.fields, 0))
+		totals["count"] += 1
+		totals["seconds"] += seconds
+		totals["max_seconds"] = max(totals["max_seconds"], seconds)
+		totals["api_calls"] += api_calls
+		totals["characters"] += characters
+		totals["held_bytes"] = held
+		if seconds * 1000 >= preference("copy_edit_slow_ms", 100):
+			print("CopyEdit: {0} took {1:.1f} ms ({2} view API calls, {3} characters, {4} bytes held)".format(
+				op, seconds * 1000, api_calls, characters, held))
+
+	def summary(self):
+		lines = ["{0:<18} {1:>7} {2:>10} {3:>10} {4:>10} {5:>12} {6:>12}".format("operation", "count", "total ms", "max ms", "API calls", "characters", "held bytes")]
+		for op, t in self.ops.items():
+			lines.append("{0:<18} {1:>7} {2:>10.1f} {3:>10.1f} {4:>10} {5:>12} {6:>12}".format(
+				op, t["count"], t["seconds"] * 1000, t["max_seconds"] * 1000, t["api_calls"], t["characters"], t["held_bytes"]))
+		return lines
+
+stats = Stats()
+
+def selection_characters(*args, **kwargs):
+	return selection_strings.chars
+
+def instrumented(op, characters = selection_characters):
+	# Decorates a command's run() (or a listener hook taking the view first,
+	# or any method) so that it is measured when instrumentation is on.
+	# `characters` is called with the same arguments, after the call.
+	def decorate(function):
+		@functools.wraps(function)
+		def wrapper(self, *args, **kwargs):
+			if profiler.remaining and op in profiler.ops and not profiler.running:
+				return profiler.run(op, wrapper, self, *args, **kwargs)
+			if op in tracer.ops and not tracer.running and preference("copy_edit_trace", False):
+				return tracer.record(op, measured, self, *args, **kwargs)
+			return measured(self, *args, **kwargs)
+		def measured(self, *args, **kwargs):
+			if not preference("copy_edit_instrumentation", False):
+				return function(self, *args, **kwargs)
+			counter = None
+			if isinstance(getattr(self, "view", None), sublime.View):
+				counter = self.view = CountingView(self.view)
+			elif args and isinstance(args[0], sublime.View):
+				counter = CountingView(args[0])
+				args = (counter,) + args[1:]
+			start = time.perf_counter()
+			try:
+				return function(self, *args, **kwargs)
+			finally:
+				seconds = time.perf_counter() - start
+				if counter is not None and self.__dict__.get("view") is counter:
+					self.view = counter.view
+				stats.record(op, seconds, counter.calls if counter else 0, characters(self, *args, **kwargs) if characters else 0)
+		return wrapper
+	return decorate
+
+class CopyEditStatsCommand(sublime_plugin.ApplicationCommand):
+	def run(self, reset=False):
+		if not preference("copy_edit_instrumentation", False):
+			print("CopyEdit: set copy_edit_instrumentation to true in your Preferences to collect stats")
+		for line in stats.summary():
+			print(line)
+		if reset:
+			stats.ops.clear()
+
+class Profiler(object):
+	# Profiles the next `remaining` commands (not what they run themselves)
+	# once copy_edit_profile_next asks for it, writing a pstats file for each
+	# and printing its most expensive functions.
+	ops = ("copy", "cut", "paste", "paste_from_history", "history_menu", "history_search")
+
+	def __init__(self):
+		self.remaining = 0
+		self.running = False
+		self.directory = None
+
+	def run(self, op, function, *args, **kwargs):
+		try:
+			import cProfile as profile
+		except ImportError:
+			import profile
+		import pstats
+		self.remaining -= 1
+		self.running = True
+		profile = profile.Profile()
+		try:
+			return profile.runcall(function, *args, **kwargs)
+		finally:
+			self.running = False
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			path = os.path.join(self.directory, "{0}-{1}.pstats".format(op, time.strftime("%Y%m%d-%H%M%S")))
+			n = 1
+			while os.path.exists(path):
+				n += 1
+				path = os.path.join(self.directory, "{0}-{1}-{2}.pstats".format(op, time.strftime("%Y%m%d-%H%M%S"), n))
+			profile.dump_stats(path)
+			out = io.StringIO()
+			pstats.Stats(path, stream = out).sort_stats("cumulative").print_stats(preference("copy_edit_profile_lines", 20))
+			print("CopyEdit: profile of {0} written to {1}".format(op, path))
+			print(out.getvalue())
+
+profiler = Profiler()
+
+class Tracer(object):
+	# With copy_edit_trace on, appends a line of JSON to the trace file for
+	# every cut, copy, paste and paste from history: the operation and its
+	# arguments, how long it took, the buffer size and line endings, the
+	# selections (as gaps and lengths), where their lines start and end, and
+	# the lengths of the copied strings. With copy_edit_trace_text on, the
+	# copied strings and the buffer text (when it changed) are recorded too.
+	# benchmarks/replay_trace.py replays a trace headlessly.
+	ops = ("copy", "cut", "paste", "paste_from_history", "paste_template")
+
+	def __init__(self):
+		self.running = False
+		self.started = None
+		self.texts = {} # view id -> change count of the buffer text last recorded
+
+	def path(self):
+		return preference("copy_edit_trace_path", None) or os.path.join(sublime.cache_path(), "CopyEdit", "trace.jsonl")
+
+	def record(self, op, function, command, *args, **kwargs):
+		view = command.view
+		regions = [(s.begin(), s.end()) for s in view.sel()]
+		# not kept, so that the operation finds no index and is timed as it would run untraced
+		lines = LineIndex.lines(view, [p for region in regions for p in region], keep = False)
+		with_text = preference("copy_edit_trace_text", False)
+		# a template and its lists are text, so without text only the numbers are recorded
+		arguments = kwargs if with_text else {k: v for k, v in kwargs.items() if isinstance(v, (int, float))}
+		entry = collections.OrderedDict(op = op, args = arguments, view = view.id(), size = view.size(), le = view.line_endings())
+		selections = []
+		prev = 0
+		for begin, end in regions:
+			line_start, line_end = next(lines), next(lines)
+			selections.extend((begin - prev, end - begin, begin - line_start[0], line_end[1] - end))
+			prev = end
+		entry["sel"] = selections # gap, length, offset from line start, distance to line end, for each selection
+		if with_text and self.texts.get(view.id()) != view.change_count():
+			entry["text"] = view.substr(sublime.Region(0, view.size()))
+			self.texts[view.id()] = view.change_count()
+		if self.started is None:
+			self.started = time.time()
+		entry["t"] = round(time.time() - self.started, 3)
+		self.running = True
+		start = time.perf_counter()
+		try:
+			return function(command, *args, **kwargs)
+		finally:
+			entry["ms"] = round((time.perf_counter() - start) * 1000, 3)
+			self.running = False
+			entry["seg"] = [len(s[0]) for s in selection_strings]
+			entry["wl"] = [i for i, s in enumerate(selection_strings) if s[1]]
+			if with_text:
+				entry["strings"] = [s[0] for s in selection_strings]
+				self.texts[view.id()] = view.change_count() if op == "copy" else None
+			path = self.path()
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+			with open(path, "a") as f:
+				f.write(json.dumps(entry, separators = (",", ":")) + "\n")
+
+tracer = Tracer()
+
+class CopyEditProfileNextCommand(sublime_plugin.ApplicationCommand):
+	def run(self, count=1, directory=None):
+		profiler.directory = directory or preference("copy_edit_profile_dir", None) or os.path.join(sublime.cache_path(), "CopyEdit", "profiles")
+		profiler.remaining = count
+		print("CopyEdit: profiling the next {0} cut/copy/paste command{1}, into {2}".format(count, "s" if count != 1 else "", profiler.directory))
+
+class LineIndex(object):
+	# Start of every line of a buffer, for looking up the lines of many
+	# selections at once. Building one means reading the whole buffer, so it
+	# is only done when there are enough lookups to pay for it (roughly one
+	# per `chars_per_lookup` characters), a piece at a time; the last one
+	# built is kept until the buffer changes.
+	chars_per_lookup = 512
+	chunk_size = 1 << 18
+	last = None
+
+	def __init__(self, view):
+		self.buffer_id = view.buffer_id()
+		self.change_count = view.change_count()
+		self.size = view.size()
+		self.starts = array.array("L", [0])
+		for pos in range(0, self.size, self.chunk_size):
+			text = view.substr(sublime.Region(pos, min(pos + self.chunk_size, self.size)))
+			self.starts.extend(pos + m.end() for m in re.finditer("\n", text))
+
+	def is_current(self, view):
+		return self.buffer_id == view.buffer_id() and self.change_count == view.change_count()
+
+	@classmethod
+	def lines(cls, view, points, keep = True):
+		# Yields the (begin, end) of the line containing each point, like
+		# view.line(); points must be in ascending order, as selections are.
+		# Points on the same line share one lookup. With keep off, an index
+		# built for this isn't kept for later lookups.
+		index = cls.last if cls.last is not None and cls.last.is_current(view) else None
+		if index is None and len(points) * cls.chars_per_lookup >= view.size() and len(points) > 1:
+			index = cls(view)
+			if keep:
+				cls.last = index
+		begin = end = -1
+		j = 0
+		for p in points:
+			if not begin <= p <= end:
+				if index is None:
+					line = view.line(p)
+					begin, end = line.begin(), line.end()
+				else:
+					j = bisect.bisect_right(index.starts, p, j) - 1
+					begin = index.starts[j]
+					end = index.starts[j + 1] - 1 if j + 1 < len(index.starts) else index.size
+			yield begin, end
+
+def clipboard_text(strings, line_ending):
+	# Joins copied strings for the clipboard, converting line endings in one
+	# pass over the joined text rather than making a converted copy of every
+	# string first. In Unix files a single string (the common case for huge
+	# copies) is passed through as it is, so that selection_strings, the
+	# clipboard and paste history all share it.
+	text = "\n".join([s[0] for s in strings])
+	if line_ending == "\n":
+		return text
+	return text.replace("\n", line_ending)
 
 class CopyEditCommand(sublime_plugin.TextCommand):
 	@staticmethod
-	def copy(self, edit):
+	def copy(self, edit, verb = "Copied"):
 		#See copy_with_empty_selection note above.
 		copy_with_empty_sel = self.view.settings().get("copy_with_empty_selection")
 		
+		lines = LineIndex.lines(self.view, array.array("L", (s.a for s in self.view.sel() if s.empty()))) if copy_with_empty_sel else None
 		new_sel_strings = []
+		line = None
 		for s in self.view.sel():
 			if len(s):
 				new_sel_strings.append((self.view.substr(s), False))
 			elif copy_with_empty_sel:
-				new_sel_strings.append((self.view.substr(self.view.line(s)) + "\n", True))
+				span = next(lines)
+				if line is None or line[0] != span:
+					line = (span, (self.view.substr(sublime.Region(*span)) + "\n", True))
+				new_sel_strings.append(line[1])
 
 		actual_selection_strings = new_sel_strings
-		if all(s == new_sel_strings[0] for s in new_sel_strings):
-			new_sel_strings = [new_sel_strings[0]]
+		new_sel_strings = SelectionStrings(new_sel_strings)
+		if len(new_sel_strings.unique) == 1: # all the same
+			new_sel_strings = SelectionStrings(new_sel_strings.unique)
 
 		if len(new_sel_strings) > 0:
-			selection_strings[:] = [] #.clear() doesn't exist in 2.7
-			selection_strings.extend(new_sel_strings)
-			line_ending = line_endings[self.view.line_endings()]
-			sublime.set_clipboard(add_string_to_paste_history(line_ending.join([s[0].replace('\n', line_ending) for s in selection_strings])))
+			selection_strings[:] = new_sel_strings
+			clipboard_publisher.publish(new_sel_strings, line_endings[self.view.line_endings()], verb)
 			return actual_selection_strings
 		return False
 	
+	@instrumented("copy")
 	def run(self, edit):
-		if self.copy(self, edit):
-			print_status_message("Copied")
+		self.copy(self, edit)
+
+def merge_spans(spans):
+	# Sorts (begin, end) spans and merges the overlapping or adjacent ones, so
+	# that each stretch of text is erased by exactly one buffer edit.
+	merged = []
+	for begin, end in sorted(spans):
+		if merged and begin <= merged[-1][1]:
+			if end > merged[-1][1]:
+				merged[-1][1] = end
+		else:
+			merged.append([begin, end])
+	return merged
 
 class CutEditCommand(sublime_plugin.TextCommand):
+	def erase_spans(self):
+		copy_with_empty_sel = self.view.settings().get("copy_with_empty_selection")
+		lines = LineIndex.lines(self.view, array.array("L", (s.a for s in self.view.sel() if s.empty()))) if copy_with_empty_sel else None
+		size = self.view.size()
+		spans = []
+		for s in self.view.sel():
+			if len(s):
+				spans.append((s.begin(), s.end()))
+			elif copy_with_empty_sel:
+				begin, end = next(lines)
+				spans.append((begin, min(end + 1, size))) # full_line()
+		return spans
+
+	@instrumented("cut")
 	def run(self, edit):
-		actual_selection_strings = CopyEditCommand.copy(self, edit)
-		if actual_selection_strings:
-			print_status_message("Cut")
-			for s, ss in reversed(list(zip(self.view.sel(), actual_selection_strings))):
-				self.view.erase(edit, self.view.full_line(s) if ss[1] else s)
+		if CopyEditCommand.copy(self, edit, "Cut"):
+			for begin, end in reversed(merge_spans(self.erase_spans())):
+				self.view.erase(edit, sublime.Region(begin, end))
+
+#A note about paste plans
+#------------------------
+#paste_plan() works out what a paste does to the buffer without touching it:
+#given the selection regions as (begin, end) pairs in document order, the
+#(text, whole_line) strings to paste and, when some string is a whole line,
+#the line start of each region's begin, it returns the non-overlapping
+#(begin, end, text) replacements in original buffer coordinates, in document
+#order, plus the caret each selection ends up at. This is exactly what
+#replacing/inserting selection by selection used to do, including where
+#whole lines land when several selections share a line.
+
+def strings_per_selection(numsels, numstrings):
+	if numstrings <= numsels and numsels % numstrings == 0:
+		return 1
+	elif numsels < numstrings and numstrings % numsels == 0:
+		return numstrings // numsels
+	else:
+		return numstrings
+
+def paste_plan(regions, strings, line_starts=None):
+	numsels = len(regions)
+	numstrings = len(strings)
+	strs_per_sel = strings_per_selection(numsels, numstrings)
+	replace_each = numsels == numstrings or numstrings == 1 # fix for test #10 (character-by-character selection)
+	need_lines = line_starts is not None
+
+	pieces = []       # [begin, end, text] for every replaced region
+	piece_carets = [] # selections whose caret sits in each piece
+	owner = [None] * numsels  # piece holding the caret, or None if it stays at an original point
+	offset = [0] * numsels    # caret offset into the owner's text (or the original point)
+	alias = [None] * numsels  # selection whose caret this one ends up merged with
+	groups = [] # [line start, text inserted there, first piece, last piece containing \n]
+	group = None
+	prev_end = -1
+
+	# Whole lines go to the start of the line as it is at that moment, which
+	# may be inside text already pasted on the same line (after its last \n).
+	def insert_line(text):
+		nl = group[3]
+		if nl >= 0:
+			piece = pieces[nl]
+			k = piece[2].rfind("\n") + 1
+			piece[2] = piece[2][:k] + text + piece[2][k:]
+			for j in piece_carets[nl]:
+				if offset[j] >= k:
+					offset[j] += len(text)
+		else:
+			k = group[1].rfind("\n") + 1
+			group[1] = group[1][:k] + text + group[1][k:]
+
+	def new_piece(i, begin, end, text):
+		pieces.append([begin, end, text])
+		piece_carets.append([i])
+		owner[i] = len(pieces) - 1
+		offset[i] = len(text)
+		if need_lines and "\n" in text:
+			group[3] = len(pieces) - 1
+
+	# strs_per_sel either divides numstrings or equals it, so the strings are
+	# always taken in order, starting over after the last one
+	cycle = itertools.chain.from_iterable(itertools.repeat(strings))
+	for i, (begin, end) in enumerate(regions):
+		# Selections separated by line breaks of the original text never affect each other's line starts
+		if group is None or need_lines and line_starts[i] > prev_end:
+			group = [line_starts[i] if need_lines else begin, "", len(pieces), -1]
+			groups.append(group)
+
+		if replace_each:
+			string = next(cycle)
+			if string[1] and begin == end:
+				insert_line(string[0])
+				offset[i] = begin
+			else:
+				new_piece(i, begin, end, string[0])
+		else:
+			if begin == prev_end and i > 0: # the previous caret is pushed along by everything inserted here
+				alias[i-1] = i
+			new_piece(i, begin, end, "")
+			parts = []
+			for string in itertools.islice(cycle, strs_per_sel):
+				if string[1] and need_lines:
+					if parts:
+						pieces[-1][2] += "".join(parts)
+						parts = []
+					if "\n" in pieces[-1][2]:
+						group[3] = len(pieces) - 1
+					insert_line(string[0])
+				else:
+					parts.append(string[0])
+			text = pieces[-1][2] + "".join(parts)
+			pieces[-1][2] = text
+			offset[i] = len(text)
+			if need_lines and "\n" in text:
+				group[3] = len(pieces) - 1
+		prev_end = end
+
+	edits = []
+	starts = [0] * len(pieces) # final position of each piece
+	delta = 0
+	for g, (line_start, head, first, nl) in enumerate(groups):
+		last = groups[g+1][2] if g + 1 < len(groups) else len(pieces)
+		if head:
+			if first < last and pieces[first][0] == line_start:
+				pieces[first][2] = head + pieces[first][2]
+				for j in piece_carets[first]:
+					offset[j] += len(head)
+			else:
+				edits.append((line_start, line_start, head))
+				delta += len(head)
+		for p in range(first, last):
+			begin, end, text = pieces[p]
+			starts[p] = begin + delta
+			if text or begin != end:
+				edits.append((begin, end, text))
+				delta += len(text) - (end - begin)
+
+	carets = [0] * numsels
+	e = 0
+	delta = 0
+	for i in range(numsels):
+		if owner[i] is None:
+			while e < len(edits) and edits[e][0] <= offset[i]:
+				delta += len(edits[e][2]) - (edits[e][1] - edits[e][0])
+				e += 1
+			carets[i] = offset[i] + delta
+		else:
+			carets[i] = starts[owner[i]] + offset[i]
+	for i in reversed(range(numsels)):
+		if alias[i] is not None:
+			carets[i] = carets[alias[i]]
+	return edits, carets
+
+def joined(strings): # all the copied strings pasted at a single selection
+	return ("" if strings[0][1] else "\n").join([s[0] for s in strings]) # ‘this check is needed because if strings[0][1] == True, then \n is already present at the end of line’\‘проверка нужна, так как если strings[0][1] == True, то \n уже есть в конце строки’
+
+def adopt_clipboard():
+	#check if clipboard is more up to date
+	if clipboard_publisher.authoritative(): # otherwise the last copy isn't even on the clipboard yet and selection_strings has it
+		return
+	clipboard_publisher.flush()
+	pasteboard = sublime.get_clipboard()
+	if not clipboard_is_remembered(pasteboard): # this is needed when string was copied to clipboard not within Sublime Text
+		remember_clipboard(pasteboard)
+		selection_strings.clear()
+		if clipboard_key is not None: # it may be an earlier copy from paste history, split it up the same way
+			selection_strings.extend(paste_history.strings(clipboard_key, pasteboard) or [(pasteboard, False)])
+		else:
+			selection_strings.append((pasteboard, False))
 
 class PasteEditCommand(sublime_plugin.TextCommand):
+	@instrumented("paste")
 	def run(self, edit):
 		global selection_strings
 		
-		#check if clipboard is more up to date
-		pasteboard = add_string_to_paste_history(sublime.get_clipboard()) # this is needed when string was copied to clipboard not within Sublime Text
-		from_clipboard = False
-		if pasteboard != '\n'.join([s[0] for s in selection_strings]):
-			selection_strings[:] = [] #.clear() doesn't exist in 2.7
-			selection_strings.append((pasteboard, False))
-			from_clipboard = True #what should be done in this case?
+		if self.view.id() in ChunkedPaste.running:
+			sublime.status_message("Still pasting, run cancel_paste_edit to stop")
+			return
+
+		adopt_clipboard()
 		
-		numstrings = len(selection_strings)
-		numsels = len(self.view.sel())
+		sel = self.view.sel()
+		regions = [(s.begin(), s.end()) for s in sel]
+		numsels = len(regions)
 		if numsels == 0:
 			return
 		
 		if numsels == 1: # To fix TN 7
-			selection_strings = [(("" if selection_strings[0][1] else "\n") # ‘this check is needed because if selection_strings[0][1] == True, then \n is already present at the end of line’\‘проверка нужна, так как если selection_strings[0][1] == True, то \n уже есть в конце строки’
-				.join([s[0] for s in selection_strings]), selection_strings[0][1])]
-			numstrings = 1
-
-		if numstrings <= numsels and numsels % numstrings == 0:
-			strs_per_sel = 1
-		elif numsels < numstrings and numstrings % numsels == 0:
-			strs_per_sel = int(numstrings / numsels)
+			selection_strings = SelectionStrings([(joined(selection_strings), selection_strings[0][1])])
+
+		line_starts = None
+		if any(s[1] for s in selection_strings.unique):
+			line_starts = [line[0] for line in LineIndex.lines(self.view, [begin for begin, end in regions])]
+		edits, carets = paste_plan(regions, selection_strings, line_starts)
+		apply_paste(self.view, edit, edits, carets, status_text("Pasted", numsels))
+
+def dense(edits, min_edits = 16, max_gap = 64):
+	# Whether a paste's edits are many and close together (one per line of a
+	# block, column selections, character-split selections), so that
+	# rewriting the text they span costs less than one buffer edit each.
+	if len(edits) < min_edits:
+		return False
+	gaps = edits[-1][1] - edits[0][0] - sum(end - begin for begin, end, text in edits)
+	return gaps <= max_gap * len(edits)
+
+def apply_paste(view, edit, edits, carets, message):
+	# Makes the edits of a paste plan, shows `message` and puts the carets
+	# where the plan says; very large pastes go to ChunkedPaste instead.
+	size = sum(len(text) for begin, end, text in edits)
+	if size >= preference("copy_edit_chunked_paste_size", 64 << 20) > 0 and not view.is_read_only():
+		ChunkedPaste.start(view, edits, carets, message, size)
+		return
+
+	if dense(edits):
+		# One replace of the whole stretch is much cheaper than one per selection.
+		# The text between the edits is read in one call too, unless the text
+		# they replace is larger than it; then each gap is read on its own.
+		span_begin, span_end = edits[0][0], edits[-1][1]
+		replaced = sum(end - begin for begin, end, text in edits)
+		if replaced <= span_end - span_begin - replaced:
+			original = view.substr(sublime.Region(span_begin, span_end))
+			gap = lambda begin, end: original[begin - span_begin:end - span_begin]
 		else:
-			strs_per_sel = numstrings
-		
-		if numsels == numstrings or numstrings == 1: # fix for test #10 (character-by-character selection)
-			sel_strings = iter(selection_strings)
-			string = next(sel_strings)
-			for sel in self.view.sel():
-				replace_region = sublime.Region(self.view.line(sel.begin()).begin()) if string[1] and sel.size() == 0 else sel
-				self.view.replace(edit, replace_region, string[0])
-				string = next(sel_strings, None)
-				if string == None:
-					sel_strings = iter(selection_strings)
-					string = next(sel_strings)
+			gap = lambda begin, end: view.substr(sublime.Region(begin, end))
+		parts = [edits[0][2]]
+		pos = edits[0][1]
+		for begin, end, text in edits[1:]:
+			if begin > pos:
+				parts.append(gap(pos, begin))
+			parts.append(text)
+			pos = end
+		view.replace(edit, sublime.Region(span_begin, span_end), "".join(parts))
+	else:
+		for begin, end, text in reversed(edits): # back to front, so the plan's coordinates stay valid
+			view.replace(edit, sublime.Region(begin, end), text)
+
+	sublime.status_message(message)
+
+	sel = view.sel()
+	sel.clear()
+	sel.add_all([sublime.Region(caret, caret) for caret in carets])
+
+class TemplateStrings(object):
+	# The text paste_template_edit puts at each selection, made from
+	# `template` when it is needed rather than all at once. The template is
+	# a str.format() string that can use
+	#   {n}     a counter: start, start + step, ... ({n:03} pads it with zeros)
+	#   {i}     the number of the selection, from 0
+	#   {text}  the copied text for this selection, distributed as paste does:
+	#           one string each, or several joined when there are more
+	#           strings than selections, and all of them for one selection
+	#   {sel}   the text the selection currently holds
+	#   {name}  the next item of lists[name], starting over after the last one
+	def __init__(self, template, view, regions, strings, start = 1, step = 1, lists = None):
+		self.template = template
+		self.view = view
+		self.regions = regions
+		self.strings = strings
+		self.start = start
+		self.step = step
+		self.lists = lists or {}
+		self.chars = 0
+
+	def __len__(self):
+		return len(self.regions)
+
+	def __iter__(self):
+		strings = itertools.chain.from_iterable(itertools.repeat(self.strings))
+		per_selection = strings_per_selection(len(self.regions), len(self.strings)) if self.strings else 0
+		for i, (begin, end) in enumerate(self.regions):
+			taken = list(itertools.islice(strings, per_selection))
+			if len(self.regions) == 1 and taken: # To fix TN 7, like paste
+				text = joined(taken)
+			else:
+				text = "".join([s[0] for s in taken])
+			fields = dict((name, values[i % len(values)]) for name, values in self.lists.items() if values)
+			fields.update(n = self.start + i * self.step, i = i, text = text,
+				sel = self.view.substr(sublime.Region(begin, end)) if begin != end else "")
+			text = self.template.format(**fields)
+			self.chars += len(text)
+			yield (text, False)
+
+class PasteTemplateEditCommand(sublime_plugin.TextCommand):
+	# Pastes text made from a template at every selection, see TemplateStrings.
+	# Without a template, asks for one.
+	@instrumented("paste_template", None)
+	def run(self, edit, template = None, start = 1, step = 1, lists = None):
+		if template is None:
+			self.view.window().show_input_panel("Paste template ({n} counter, {i} index, {text} copied text, {sel} selection):", "{text}",
+				lambda template: self.view.run_command("paste_template_edit", {"template": template, "start": start, "step": step, "lists": lists}), None, None)
+			return
+		if self.view.id() in ChunkedPaste.running:
+			sublime.status_message("Still pasting, run cancel_paste_edit to stop")
+			return
+		adopt_clipboard()
+		regions = [(s.begin(), s.end()) for s in self.view.sel()]
+		if not regions:
+			return
+		texts = TemplateStrings(template, self.view, regions, selection_strings, start, step, lists)
+		try:
+			edits, carets = paste_plan(regions, texts)
+		except (KeyError, IndexError, ValueError, AttributeError, TypeError) as e: # e.g. "{x}", "{i[0]}", "{text.x}"
+			sublime.status_message("Bad paste template {0!r}: {1}".format(template, e))
+			return
+		apply_paste(self.view, edit, edits, carets, status_text("Pasted", len(regions), numchars = texts.chars))
+
+class ChunkedPaste(object):
+	# A paste too large to do in one go (see copy_edit_chunked_paste_size) is
+	# applied by paste_chunk_edit a few megabytes at a time, one event loop
+	# tick per chunk, back to front so that the plan's coordinates stay valid;
+	# a huge string is inserted in slices. The text each edit replaces is read
+	# up front, before the buffer changes. The view is read-only until the
+	# paste is done, so nothing else can edit it in between. Cancelling puts
+	# back what was replaced, so the buffer ends up as it was.
+	#
+	# Every chunk is an undo step of its own, so an undo (or redo) right after
+	# a chunked paste is turned into one per chunk (see undo_steps and
+	# undo_paste_chunks_edit), which takes the whole paste back at once.
+	running = {} # view id -> ChunkedPaste
+	undo_steps = {} # view id -> ("undo" or "redo", how many, change count after the paste or its undo)
+
+	def __init__(self, view, edits, carets, message, size):
+		self.edits = edits
+		self.carets = carets
+		self.message = message
+		self.size = size
+		self.done = 0
+		self.chunks = 0
+		replaced = [view.substr(sublime.Region(begin, end)) if end > begin else "" for begin, end, text in edits]
+		self.steps = self.slices(edits, replaced, max(preference("copy_edit_paste_chunk_size", 4 << 20), 1))
+		self.step = next(self.steps, None)
+		self.applied = [] # (begin, length of the text put there, text it replaced), to cancel
+		self.change_count = view.change_count()
+		self.read_only = view.is_read_only()
+
+	@staticmethod
+	def slices(edits, replaced, chunk_size):
+		for (begin, end, text), old in zip(reversed(edits), reversed(replaced)):
+			yield begin, end, text[:chunk_size], old
+			for i in range(chunk_size, len(text), chunk_size):
+				yield begin + i, begin + i, text[i:i + chunk_size], ""
+
+	@classmethod
+	def start(cls, view, edits, carets, message, size):
+		cls.running[view.id()] = cls(view, edits, carets, message, size)
+		cls.undo_steps.pop(view.id(), None)
+		view.set_read_only(True)
+		sublime.set_timeout(lambda: view.run_command("paste_chunk_edit"), 0)
+
+	def apply(self, view, edit, chunk_size):
+		# Applies up to chunk_size characters of the paste; returns True when it is complete.
+		budget = chunk_size
+		while self.step is not None and budget > 0:
+			begin, end, text, old = self.step
+			self.applied.append((begin, len(text), old))
+			view.replace(edit, sublime.Region(begin, end), text)
+			self.done += len(text)
+			budget -= max(len(text), 1)
+			self.step = next(self.steps, None)
+		self.chunks += 1
+		self.change_count = view.change_count()
+		return self.step is None
+
+	def revert(self, view, edit):
+		for begin, length, text in reversed(self.applied):
+			view.replace(edit, sublime.Region(begin, begin + length), text)
+
+class PasteChunkEditCommand(sublime_plugin.TextCommand):
+	def run(self, edit, cancel = False):
+		paste = ChunkedPaste.running.get(self.view.id())
+		if paste is None:
+			return
+		self.view.set_read_only(False)
+		if paste.change_count != self.view.change_count():
+			# Only something that ignores read-only views (like reloading the
+			# file) gets here; what changed is unknown, so nothing is put back.
+			del ChunkedPaste.running[self.view.id()]
+			sublime.status_message("Paste stopped because the buffer was changed, {0} of {1} characters pasted".format(paste.done, paste.size))
+		elif cancel:
+			del ChunkedPaste.running[self.view.id()]
+			paste.revert(self.view, edit)
+			sublime.status_message("Paste cancelled")
+		elif paste.apply(self.view, edit, max(preference("copy_edit_paste_chunk_size", 4 << 20), 1)):
+			del ChunkedPaste.running[self.view.id()]
+			ChunkedPaste.undo_steps[self.view.id()] = ("undo", paste.chunks, self.view.change_count())
+			sublime.status_message(paste.message)
+			sel = self.view.sel()
+			sel.clear()
+			sel.add_all([sublime.Region(caret, caret) for caret in paste.carets])
 		else:
-			str_index = 0
-			for sel in self.view.sel():
-				self.view.erase(edit, sel)
-				insertion_point = sel.begin()
-				for string in selection_strings[str_index:str_index+strs_per_sel]:
-					self.view.insert(edit, self.view.line(insertion_point).begin() if string[1] else insertion_point, string[0])
-					insertion_point += len(string[0])
-					region = sublime.Region(insertion_point)
-				str_index = (str_index + strs_per_sel) % numstrings
-		
-		print_status_message("Pasted", len(self.view.sel()))
-		
-		new_sels=[]
-		for s in self.view.sel():
-			caret=s.end()
-			new_sels.append(sublime.Region(caret,caret))
-		self.view.sel().clear()
-		for s in new_sels:
-			self.view.sel().add(s)
+			self.view.set_read_only(True)
+			sublime.status_message("Pasting... {0}% (run cancel_paste_edit to stop)".format(paste.done * 100 // paste.size))
+			sublime.set_timeout(lambda: self.view.run_command("paste_chunk_edit"), 0)
+			return
+		self.view.set_read_only(paste.read_only)
+
+class CancelPasteEditCommand(sublime_plugin.TextCommand):
+	def run(self, edit):
+		self.view.run_command("paste_chunk_edit", {"cancel": True})
+
+	def is_enabled(self):
+		return self.view.id() in ChunkedPaste.running
+
+class UndoPasteChunksEditCommand(sublime_plugin.TextCommand):
+	# Runs `command` (undo or redo) `times` times, one event loop tick each,
+	# then remembers that the opposite command takes it back.
+	def run(self, edit, command, times):
+		view = self.view
+		def step(left):
+			if left > 0:
+				view.run_command(command)
+				sublime.set_timeout(lambda: step(left - 1), 0)
+			else:
+				ChunkedPaste.undo_steps[view.id()] = ("redo" if command == "undo" else "undo", times, view.change_count())
+		sublime.set_timeout(lambda: step(times), 0)
+
+def utf8_chunks(string, chunk_size = 1 << 20):
+	# Encodes a large string a piece at a time, so that it never exists in
+	# memory twice (Python strings can't be split inside a character).
+	for i in range(0, len(string), chunk_size):
+		yield string[i:i + chunk_size].encode("utf-8", "surrogatepass")
+
+def inflate_chunks(packed, chunk_size = 1 << 20):
+	# Decompresses zlib data a piece of at most `chunk_size` bytes at a time.
+	decompressor = zlib.decompressobj()
+	for i in range(0, len(packed), chunk_size):
+		data = decompressor.decompress(packed[i:i + chunk_size], chunk_size)
+		while True:
+			yield data
+			if not decompressor.unconsumed_tail:
+				break
+			data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+	yield decompressor.flush()
 
-paste_history_deque = collections.deque(maxlen = 15) # 15 is the same as in SublimeText's "Paste from History" list
+def segments_of(strings, line_ending):
+	# Where each of the copied (text, whole_line) strings ends in the
+	# clipboard text made of them (see clipboard_text()), and which of them
+	# are whole lines; None for a single plain string.
+	if len(strings) == 1 and not strings[0][1]:
+		return None
+	ends = array.array("L")
+	pos = 0
+	for text, whole_line in strings:
+		pos += len(text) + text.count("\n") * (len(line_ending) - 1)
+		ends.append(pos)
+		pos += len(line_ending)
+	return (ends, bytes(bytearray(whole_line for text, whole_line in strings)), line_ending)
+
+class HistoryEntry(object):
+	# One paste history string. Strings shorter than `compress_size` stay in
+	# memory as they are, larger ones are kept zlib-compressed, and if even the
+	# compressed data is larger than `spill_size` it goes to a temporary file.
+	# `preview` is how the string is shown in the paste-from-history list.
+	# `segments` (see segments_of()) tells how to split a string copied from
+	# several selections back into the strings of each selection.
+	__slots__ = ("length", "preview", "string", "packed", "path", "digest", "segments")
+
+	def __init__(self, string, compress_size, spill_size):
+		self.length = len(string)
+		self.preview = (string if self.length < 45 else string[:45] + '...').replace("\n", " ").replace("\t", " ")
+		self.string = string
+		self.packed = None
+		self.path = None
+		self.digest = None
+		self.segments = None
+		if self.length >= compress_size:
+			self.string = None
+			sha1 = hashlib.sha1() # the digest can't be computed later without decompressing
+			compressor = zlib.compressobj(1)
+			parts = []
+			for data in utf8_chunks(string):
+				sha1.update(data)
+				parts.append(compressor.compress(data))
+				self.spill(parts, spill_size)
+			parts.append(compressor.flush())
+			self.spill(parts, spill_size)
+			self.digest = sha1.digest()
+			if self.path is None:
+				self.packed = b"".join(parts)
+
+	@classmethod
+	def unpack(cls, packed, spill_size):
+		# An entry for a string that is already zlib-compressed UTF-8 (see
+		# HistoryLog), made without ever holding all of it decompressed.
+		self = cls.__new__(cls)
+		self.string = None
+		self.packed = None
+		self.path = None
+		self.segments = None
+		sha1 = hashlib.sha1()
+		decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+		self.length = 0
+		head = ""
+		for data in inflate_chunks(packed):
+			sha1.update(data)
+			text = decoder.decode(data)
+			if len(head) < 46:
+				head += text[:46]
+			self.length += len(text)
+		self.digest = sha1.digest()
+		self.preview = (head if len(head) < 45 else head[:45] + '...').replace("\n", " ").replace("\t", " ")
+		parts = [packed]
+		self.spill(parts, spill_size)
+		if self.path is None:
+			self.packed = packed
+		return self
+
+	def spill(self, parts, spill_size):
+		# Moves compressed data to the temporary file as soon as there is too
+		# much of it to keep in memory.
+		if self.path is None:
+			if sum(len(p) for p in parts) < spill_size:
+				return
+			fd, self.path = tempfile.mkstemp(prefix = "copy_edit_", suffix = ".zlib")
+			os.close(fd)
+		with open(self.path, "ab") as f:
+			f.writelines(parts)
+		del parts[:]
+
+	def get_digest(self):
+		if self.digest is None:
+			self.digest = PasteHistory.digest(self.string)
+		return self.digest
+
+	def text(self):
+		if self.string is not None:
+			return self.string
+		packed = self.packed
+		if packed is None:
+			with open(self.path, "rb") as f:
+				packed = f.read()
+		return zlib.decompress(packed).decode("utf-8", "surrogatepass")
+
+	def head(self, chars): # the first `chars` characters, decompressing no more than needed
+		if self.string is not None:
+			return self.string[:chars]
+		packed = self.packed
+		if packed is None:
+			with open(self.path, "rb") as f:
+				packed = f.read()
+		decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+		parts = []
+		n = 0
+		for data in inflate_chunks(packed, 1 << 16):
+			parts.append(decoder.decode(data))
+			n += len(parts[-1])
+			if n >= chars:
+				break
+		return "".join(parts)[:chars]
+
+	def strings(self, text = None): # the selection strings the entry was copied from; `text` saves getting it again
+		text = self.text() if text is None else text
+		if self.segments is None:
+			return [(text, False)]
+		ends, whole_lines, line_ending = self.segments
+		strings = []
+		start = 0
+		for end, whole_line in zip(ends, bytearray(whole_lines)):
+			string = text[start:end]
+			strings.append((string.replace(line_ending, "\n") if line_ending != "\n" else string, bool(whole_line)))
+			start = end + len(line_ending)
+		return strings
+
+	def size(self): # bytes held in memory
+		size = sys.getsizeof(self.segments[0]) if self.segments is not None else 0
+		if self.string is not None:
+			return size + sys.getsizeof(self.string)
+		return size + sys.getsizeof(self.preview) + (len(self.packed) if self.packed is not None else 0)
+
+	def discard(self):
+		if self.path is not None:
+			try:
+				os.remove(self.path)
+			except OSError:
+				pass
+			self.path = None
+
+class TrigramIndex(object):
+	# Which history entries contain each three-character sequence (case
+	# insensitive), so that a search only reads the entries that contain all
+	# of the query's trigrams. Entries longer than `max_chars` are indexed and
+	# searched by their first `max_chars` characters only, which are kept
+	# lowercased, so that no search decompresses or lowercases a huge entry.
+	# New entries are indexed by the next search rather than when they are
+	# added, so copying doesn't pay for it.
+	max_chars = 1 << 16
+
+	def __init__(self):
+		self.postings = {} # trigram -> keys of the entries containing it
+		self.trigrams = {} # key -> trigrams of the entry, to unindex it
+		self.heads = {} # key -> lowercased beginning of an entry longer than max_chars
+		self.pending = {} # key -> entry added since the last search
+
+	@staticmethod
+	def of(text):
+		return set(text[i:i + 3] for i in range(len(text) - 2))
+
+	def add(self, key, entry):
+		self.pending[key] = entry
+
+	def index(self, key, entry):
+		if entry.length > self.max_chars:
+			text = self.heads[key] = entry.head(self.max_chars).lower()
+		else:
+			text = entry.text().lower()
+		trigrams = self.trigrams[key] = self.of(text)
+		for t in trigrams:
+			self.postings.setdefault(t, set()).add(key)
+
+	def remove(self, key):
+		if self.pending.pop(key, None) is not None:
+			return
+		self.heads.pop(key, None)
+		for t in self.trigrams.pop(key, ()):
+			keys = self.postings[t]
+			keys.discard(key)
+			if not keys:
+				del self.postings[t]
+
+	def candidates(self, query): # `query` is lowercase; returns None for "all of them"
+		for key, entry in self.pending.items():
+			self.index(key, entry)
+		self.pending = {}
+		if len(query) < 3:
+			return None
+		postings = sorted((self.postings.get(t, ()) for t in self.of(query)), key = len)
+		return set(postings[0]).intersection(*postings[1:])
+
+	def lowered(self, key, entry): # the text a search looks for the query in
+		return self.heads[key] if key in self.heads else entry.text().lower()
+
+def synchronized(method):
+	# Runs a PasteHistory method under the history's lock.
+	@functools.wraps(method)
+	def locked(self, *args, **kwargs):
+		with self.lock:
+			return method(self, *args, **kwargs)
+	return locked
+
+class PasteHistory(object):
+	# Most recently used strings, without duplicates. Entries are kept in an
+	# OrderedDict (oldest first) so that moving one to the front is O(1), and
+	# duplicates are found by length first and by content digest only when
+	# another entry has the same length, so that adding a string never
+	# compares it with the other entries character by character.
+	# Oldest entries are evicted when there are more than `maxlen` of them or
+	# when together they hold more than `max_bytes` of memory.
+	# Copies and deletes can be added from the async thread, so everything
+	# that reads or changes the entries holds `lock`.
+	def __init__(self, maxlen, max_bytes = 64 << 20, compress_size = 1 << 20, spill_size = 8 << 20):
+		self.maxlen = maxlen
+		self.max_bytes = max_bytes
+		self.compress_size = compress_size
+		self.spill_size = spill_size
+		self.entries = collections.OrderedDict() # key -> HistoryEntry
+		self.by_length = {} # length -> keys of the entries with this length
+		self.next_key = 0
+		self.bytes = 0
+		self.log = None # HistoryLog, when history is kept on disk
+		self.shared = None # SharedHistory, when history is shared with other instances
+		self.index = TrigramIndex()
+		self.used = {} # key -> when the entry was last added or touched, for ranking search results
+		self.clock = 0
+		self.lock = threading.RLock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __iter__(self): # entries, most recent first
+		return reversed(self.entries.values())
+
+	@synchronized
+	def __getitem__(self, idx):
+		return next(itertools.islice(iter(self), idx, None)).text()
+
+	@synchronized
+	def page(self, start, count): # previews of `count` entries from the `start`th most recent, and how many there are
+		return [e.preview for e in itertools.islice(iter(self), start, start + count)], len(self.entries)
+
+	@synchronized
+	def previews(self, keys): # the (key, preview) of those of `keys` that are still there
+		return [(key, self.entries[key].preview) for key in keys if key in self.entries]
+
+	@synchronized
+	def text(self, key): # of an entry, or None once it is gone
+		return self.entries[key].text() if key in self.entries else None
+
+	@synchronized
+	def strings(self, key, text = None): # the selection strings of an entry (see HistoryEntry.strings()), or None once it is gone
+		return self.entries[key].strings(text) if key in self.entries else None
+
+	@staticmethod
+	def digest(string):
+		if len(string) <= 1 << 20:
+			return hashlib.sha1(string.encode("utf-8", "surrogatepass")).digest()
+		sha1 = hashlib.sha1()
+		for data in utf8_chunks(string):
+			sha1.update(data)
+		return sha1.digest()
+
+	def find_digest(self, length, digest):
+		for key in self.by_length.get(length, ()):
+			if self.entries[key].get_digest() == digest:
+				return key
+		return None
+
+	def find(self, string):
+		if len(string) in self.by_length:
+			return self.find_digest(len(string), self.digest(string))
+		return None
+
+	@instrumented("history_add", lambda self, string, segments = None: len(string))
+	@synchronized
+	def add(self, string, segments = None): # returns the key of the entry
+		key = self.find(string)
+		if key is not None:
+			self.touch(key)
+			entry = self.entries[key]
+			if segments is not None: # copied again, maybe from other selections
+				self.bytes -= entry.size()
+				entry.segments = segments
+				self.bytes += entry.size()
+			if self.shared:
+				self.shared.append(string, entry.segments)
+			return key
+		entry = HistoryEntry(string, self.compress_size, self.spill_size)
+		entry.segments = segments
+		key = self.insert(entry)
+		if self.shared:
+			self.shared.append(string, segments)
+		if self.log:
+			self.log.append(entry)
+			if self.log.records > 4 * self.maxlen + 16:
+				if self.log.loaded:
+					self.log.compact(list(self.entries.values()))
+				else: # the entries of earlier sessions are only in the file
+					self.log.compact_file(self.maxlen)
+		return key
+
+	@synchronized
+	def touch(self, key): # moves an entry to the front, if it is still there
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			self.clock += 1
+			self.used[key] = self.clock
+			if self.log:
+				self.log.touch(self.entries[key])
+
+	def insert(self, entry, key = None):
+		if key is None:
+			key = self.next_key
+			self.next_key += 1
+		self.entries[key] = entry
+		self.index.add(key, entry)
+		self.clock += 1
+		self.used[key] = self.clock
+		self.bytes += entry.size()
+		self.by_length.setdefault(entry.length, []).append(key)
+		self.evict()
+		return key
+
+	@synchronized
+	def evict(self): # the oldest entries, until history is within maxlen and max_bytes
+		while len(self.entries) > self.maxlen or (self.bytes > self.max_bytes and len(self.entries) > 1):
+			self.remove(next(iter(self.entries)))
+
+	@synchronized
+	def remove(self, key):
+		entry = self.entries.pop(key)
+		self.index.remove(key)
+		del self.used[key]
+		self.bytes -= entry.size()
+		entry.discard()
+		keys = self.by_length[entry.length]
+		keys.remove(key)
+		if not keys:
+			del self.by_length[entry.length]
+
+	@synchronized
+	def clear(self):
+		for key in list(self.entries):
+			self.remove(key)
+
+	@synchronized
+	def search(self, query, limit = 100):
+		# Keys of the entries containing `query` (ignoring case), best first:
+		# entries starting with it, then entries where it starts a word, then
+		# the rest, each most recent first.
+		query = query.lower()
+		candidates = self.index.candidates(query)
+		ranked = []
+		for key in self.entries if candidates is None else candidates:
+			text = self.index.lowered(key, self.entries[key])
+			pos = text.find(query)
+			if pos != -1:
+				ranked.append((0 if pos == 0 else 1 if not text[pos - 1].isalnum() else 2, -self.used[key], key))
+		return [key for r, used, key in sorted(ranked)[:limit]]
+
+	@synchronized
+	def sync(self):
+		# Adds what the other instances copied since the last sync.
+		shared = self.shared
+		if shared is None:
+			return
+		self.shared = None # they are in the shared history already
+		for string, segments in shared.read():
+			self.add(string, segments)
+		self.shared = shared
+
+	@synchronized
+	def load(self):
+		# Replays the log, then takes in the other instances' copies.
+		self.replay()
+		self.sync()
+
+	def replay(self):
+		# Replays the log under the entries added since the plugin was loaded.
+		log = self.log
+		if log is None or log.loaded:
+			return
+		session = list(self.entries.items())
+		self.entries = collections.OrderedDict()
+		self.by_length = {}
+		self.index = TrigramIndex()
+		self.used = {}
+		self.bytes = 0
+		self.log = None
+		shared, self.shared = self.shared, None
+		for kind, value in log.read():
+			if kind == "T":
+				key = self.find_digest(*value)
+				if key is not None:
+					self.touch(key)
+			elif kind == "Z": # large strings stay compressed all the way
+				entry = HistoryEntry.unpack(value, self.spill_size)
+				key = self.find_digest(entry.length, entry.digest)
+				if key is None:
+					self.insert(entry)
+				else:
+					entry.discard()
+					self.touch(key)
+			else:
+				self.add(value)
+		for key, entry in session: # keep their keys, they may be remembered (see remember_clipboard())
+			old_key = self.find_digest(entry.length, entry.get_digest())
+			if old_key is not None:
+				self.remove(old_key)
+			self.insert(entry, key)
+		log.loaded = True
+		self.log = log
+		self.shared = shared
+
+class HistoryLog(object):
+	# Append-only file of paste history changes, one record per add: 'A' (new
+	# string as UTF-8), 'Z' (new string as zlib-compressed UTF-8) or 'T'
+	# (existing entry moved to the front, given by length and digest).
+	# Records are queued by the commands and written in batches from the
+	# async thread, so that copy and cut never wait on disk. When the file
+	# holds many more records than history has entries, it is rewritten from
+	# the current entries, or if history hasn't been loaded, from what is left
+	# of replaying the file; both happen on the async thread too.
+	header = struct.Struct(">cI")
+	length = struct.Struct(">Q")
+
+	def __init__(self, path):
+		self.path = path
+		self.loaded = False
+		self.records = 0 # in the file and queued; the earlier sessions' are counted by the first flush
+		self.counted = False
+		self.pending = []
+		self.lock = threading.Lock()    # guards pending and records
+		self.io_lock = threading.Lock() # guards the file
+
+	def append(self, entry):
+		self.queue(("A", entry))
+
+	def touch(self, entry):
+		self.queue(("T", entry))
+
+	def compact(self, entries):
+		self.queue(("C", entries), len(entries))
+
+	def compact_file(self, maxlen):
+		self.queue(("R", maxlen), maxlen) # at most
+
+	def queue(self, job, records = None): # `records`: how many the file holds after a compaction
+		with self.lock:
+			self.pending.append(job)
+			if records is None:
+				self.records += 1
+			else:
+				self.records = records
+				self.counted = True # the earlier sessions' records are compacted too
+			if len(self.pending) == 1:
+				sublime.set_timeout_async(self.flush, 500)
+
+	@classmethod
+	def encode(cls, kind, entry):
+		if kind == "T":
+			digest = entry.get_digest()
+			return cls.header.pack(b"T", cls.length.size + len(digest)) + cls.length.pack(entry.length) + digest
+		if entry.string is not None:
+			data = entry.string.encode("utf-8", "surrogatepass")
+			return cls.header.pack(b"A", len(data)) + data
+		data = entry.packed
+		if data is None:
+			try:
+				with open(entry.path, "rb") as f:
+					data = f.read()
+			except (IOError, OSError, TypeError): # evicted in the meantime
+				return b""
+		return cls.header.pack(b"Z", len(data)) + data
+
+	def flush(self):
+		with self.lock:
+			jobs, self.pending = self.pending, []
+		with self.io_lock:
+			if not self.counted:
+				earlier = self.count()
+				with self.lock:
+					if not self.counted:
+						self.records += earlier
+						self.counted = True
+			directory = os.path.dirname(self.path)
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			appends = []
+			for kind, value in jobs:
+				if kind == "C": # the entries replace everything before them
+					self.rewrite(self.encode("A", entry) for entry in value)
+					appends = []
+				elif kind == "R":
+					self.write(appends)
+					appends = []
+					self.rewrite(self.kept(value))
+				else:
+					appends.append(self.encode(kind, value))
+			self.write(appends)
+
+	def write(self, records):
+		if records:
+			with open(self.path, "ab") as f:
+				f.write(b"".join(records))
+
+	def rewrite(self, records):
+		with open(self.path + ".tmp", "wb") as f:
+			f.writelines(records)
+		os.replace(self.path + ".tmp", self.path)
+
+	def kept(self, maxlen):
+		# The records of the strings that replaying the file into a history of
+		# `maxlen` entries would keep, oldest first. The io_lock must be held.
+		kept = collections.OrderedDict() # (length, digest) -> record
+		for kind, payload in self.scan():
+			if kind == b"T":
+				key = (self.length.unpack(payload[:self.length.size])[0], payload[self.length.size:])
+				if key in kept:
+					kept.move_to_end(key)
+				continue
+			if kind == b"A":
+				key = (len(payload.decode("utf-8", "surrogatepass")), hashlib.sha1(payload).digest())
+			else:
+				entry = HistoryEntry.unpack(payload, float("inf"))
+				key = (entry.length, entry.digest)
+			kept.pop(key, None)
+			kept[key] = self.header.pack(kind, len(payload)) + payload
+			if len(kept) > maxlen:
+				kept.popitem(last = False)
+		return list(kept.values())
+
+	def count(self):
+		# The records in the file, read without their payloads.
+		records = 0
+		try:
+			f = open(self.path, "rb")
+		except (IOError, OSError):
+			return records
+		with f:
+			while True:
+				header = f.read(self.header.size)
+				if len(header) < self.header.size:
+					return records
+				f.seek(self.header.unpack(header)[1], 1)
+				records += 1
+
+	def read(self):
+		# Yields the records oldest first: ("A", string), ("Z", the string as
+		# zlib-compressed UTF-8) or ("T", (length, digest)).
+		self.flush()
+		records = 0
+		with self.io_lock:
+			for kind, payload in self.scan():
+				records += 1
+				if kind == b"A":
+					yield "A", payload.decode("utf-8", "surrogatepass")
+				elif kind == b"Z":
+					yield "Z", payload
+				elif kind == b"T":
+					yield "T", (self.length.unpack(payload[:self.length.size])[0], payload[self.length.size:])
+		with self.lock:
+			self.records = records + len(self.pending)
+
+	def scan(self):
+		# Yields the (kind, payload) of every record in the file, oldest
+		# first. The io_lock must be held.
+		try:
+			f = open(self.path, "r+b")
+		except (IOError, OSError):
+			return
+		with f:
+			good = 0
+			while True:
+				header = f.read(self.header.size)
+				if len(header) < self.header.size:
+					break
+				kind, n = self.header.unpack(header)
+				payload = f.read(n)
+				if len(payload) < n:
+					break
+				good = f.tell()
+				yield kind, payload
+			if good < f.seek(0, 2): # drop a record torn by a crash, so that appends stay readable
+				f.truncate(good)
+
+class SharedHistory(object):
+	# Paste history shared by every Sublime instance on the machine: a ring
+	# buffer in a memory-mapped file that each instance appends its copies to
+	# and reads the others' copies from, under a file lock. The file starts
+	# with a header (magic, capacity, head and tail as offsets that only grow;
+	# the byte at offset x is at header.size + x % capacity), followed by
+	# records of a header (record size, writer instance, kind, UTF-8 length)
+	# and the string, and for kind 'S' its segments. A record never wraps
+	# around: the rest of the buffer is skipped with a 'P' record, or without
+	# one if even that doesn't fit. Writing moves the tail past the records it
+	# overwrites; a reader that fell behind the tail lost those records. A
+	# record with an impossible size means the file is damaged: writing drops
+	# every record, reading skips to the head.
+	header = struct.Struct(">4sxxxxQQQ")
+	record = struct.Struct(">IIcxxxQ")
+	magic = b"CEH1"
+
+	def __init__(self, path, capacity):
+		self.instance = struct.unpack(">I", os.urandom(4))[0] or 1
+		directory = os.path.dirname(path)
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.file = open(path, "a+b")
+		with self.locked(True):
+			size = os.fstat(self.file.fileno()).st_size
+			if size < self.header.size:
+				size = self.header.size + (capacity & ~7)
+				self.file.truncate(size)
+			self.map = mmap.mmap(self.file.fileno(), size)
+			magic, self.capacity, head, tail = self.header.unpack_from(self.map)
+			if magic != self.magic or self.header.size + self.capacity != size:
+				self.capacity = (size - self.header.size) & ~7
+				head = tail = 0
+				self.header.pack_into(self.map, 0, self.magic, self.capacity, head, tail)
+		self.pos = tail # an instance starts with what the others have left in the buffer
+
+	def locked(self, exclusive):
+		return FileLock(self.file, exclusive)
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+	@classmethod
+	def encode(cls, string, segments):
+		# The data after the record header, in pieces.
+		data = string.encode("utf-8", "surrogatepass")
+		if segments is None:
+			return b"A", data, [data]
+		ends, whole_lines, line_ending = segments
+		line_ending = line_ending.encode("ascii")
+		return b"S", data, [data, struct.pack(">I", len(ends)), array.array("Q", ends).tobytes(), whole_lines, struct.pack(">B", len(line_ending)), line_ending]
+
+	def append(self, string, segments = None):
+		if len(string) > self.capacity // 4: # no shorter in UTF-8, so too large without encoding it
+			return
+		kind, data, parts = self.encode(string, segments)
+		size = (self.record.size + sum(len(p) for p in parts) + 7) & ~7
+		if size > self.capacity // 4: # it would push too many others out; the clipboard still has it
+			return
+		with self.locked(True):
+			magic, capacity, head, tail = self.header.unpack_from(self.map)
+			room = capacity - head % capacity
+			start = head + room if room < size else head
+			try:
+				while tail < start + size - capacity: # before the skip record overwrites any of them
+					if tail >= head:
+						tail = start
+						break
+					tail = self.next(tail, capacity)
+			except ValueError:
+				tail = start
+			if start != head and room >= self.record.size:
+				self.record.pack_into(self.map, self.header.size + head % capacity, room, self.instance, b"P", 0)
+			head = start
+			offset = self.header.size + head % capacity
+			self.record.pack_into(self.map, offset, size, self.instance, kind, len(data))
+			offset += self.record.size
+			for p in parts:
+				self.map[offset:offset + len(p)] = p
+				offset += len(p)
+			self.header.pack_into(self.map, 0, magic, capacity, head + size, tail)
+
+	def next(self, pos, capacity):
+		# The offset of the record after the one at `pos`.
+		room = capacity - pos % capacity
+		if room < self.record.size:
+			return pos + room
+		size = self.record.unpack_from(self.map, self.header.size + pos % capacity)[0]
+		if not self.record.size <= size <= room:
+			raise ValueError("damaged shared history record at {0}".format(pos))
+		return pos + size
+
+	def read(self):
+		# The (string, segments) records the other instances appended since the
+		# last read, oldest first.
+		records = []
+		with self.locked(False):
+			magic, capacity, head, tail = self.header.unpack_from(self.map)
+			pos = self.pos if tail <= self.pos <= head else tail # behind the tail, or the file was started over
+			buffer = memoryview(self.map)
+			try:
+				while pos < head:
+					next_pos = self.next(pos, capacity)
+					offset = self.header.size + pos % capacity
+					if capacity - pos % capacity >= self.record.size:
+						size, instance, kind, n = self.record.unpack_from(self.map, offset)
+						if kind != b"P" and instance != self.instance:
+							records.append(self.decode(kind, buffer[offset + self.record.size:offset + size], n))
+					pos = next_pos
+			except ValueError:
+				pos = head
+			buffer.release()
+			self.pos = pos
+		return records
+
+	@staticmethod
+	def decode(kind, data, n):
+		string = str(data[:n], "utf-8", "surrogatepass")
+		if kind != b"S":
+			return string, None
+		count = struct.unpack_from(">I", data, n)[0]
+		pos = n + 4
+		ends = array.array("Q")
+		ends.frombytes(data[pos:pos + 8 * count])
+		pos += 8 * count
+		whole_lines = bytes(data[pos:pos + count])
+		pos += count
+		line_ending = bytes(data[pos + 1:pos + 1 + data[pos]]).decode("ascii")
+		return string, (array.array("L", ends), whole_lines, line_ending)
+
+class FileLock(object):
+	# Holds a lock on an open file for the length of a with block: shared or
+	# exclusive with fcntl, always exclusive on Windows.
+	def __init__(self, file, exclusive):
+		self.file = file
+		self.exclusive = exclusive
+
+	def __enter__(self):
+		if fcntl is not None:
+			fcntl.flock(self.file.fileno(), fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+		else:
+			os.lseek(self.file.fileno(), 0, os.SEEK_SET)
+			msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+		return self
+
+	def __exit__(self, *exc):
+		if fcntl is not None:
+			fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+		else:
+			os.lseek(self.file.fileno(), 0, os.SEEK_SET)
+			msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+paste_history = PasteHistory(15) # 15 is the same as in SublimeText's "Paste from History" list
+
+def configure_paste_history():
+	paste_history.maxlen = max(preference("copy_edit_history_size", 15), 1)
+	paste_history.max_bytes = preference("copy_edit_history_max_bytes", 64 << 20)
+	paste_history.evict() # right away when a limit was lowered
+	paste_history.compress_size = preference("copy_edit_history_compress_size", 1 << 20)
+	paste_history.spill_size = preference("copy_edit_history_spill_size", 8 << 20)
+	if not preference("copy_edit_persist_history", False):
+		paste_history.log = None
+	elif paste_history.log is None:
+		paste_history.log = HistoryLog(os.path.join(sublime.cache_path(), "CopyEdit", "paste_history.log"))
+	if not preference("copy_edit_shared_history", False):
+		if paste_history.shared:
+			paste_history.shared.close()
+		paste_history.shared = None
+	elif paste_history.shared is None:
+		paste_history.shared = SharedHistory(os.path.join(sublime.cache_path(), "CopyEdit", "shared_history.ring"), preference("copy_edit_shared_history_size", 16 << 20))
+
+def plugin_unloaded():
+	clipboard_publisher.flush()
+	if paste_history.log:
+		paste_history.log.flush()
+	paste_history.clear() # removes the temporary files of spilled entries
+	if paste_history.shared:
+		paste_history.shared.close()
+		paste_history.shared = None
 
 def add_string_to_paste_history(string):#, do_not_reorder_entries_of_paste_history_deque = False):
 	if string == "":
 		return ""
-	if string in paste_history_deque:
-		paste_history_deque.remove(string)
-	paste_history_deque.appendleft(string)
+	clipboard_publisher.flush()
+	configure_paste_history()
+	paste_history.add(string)
 	return string
 
+clipboard_fingerprint = None # (length, hash) of the text CopyEdit last put on or took from the clipboard
+clipboard_key = None # and its paste history entry
+
+def remember_clipboard(text, strings = None, line_ending = "\n"):
+	# Adds text that is put on (or taken from) the clipboard to paste history
+	# and remembers it, so that pastes only need to compare the clipboard's
+	# length and hash with it instead of rebuilding the text from
+	# selection_strings and passing it through paste history again. When the
+	# text was made from `strings`, the entry keeps where each one ends.
+	global clipboard_fingerprint, clipboard_key
+	fingerprint = (len(text), hash(text))
+	key = None
+	with paste_history.lock: # this may run on the async thread; a paste sees both globals change at once
+		if text:
+			configure_paste_history()
+			paste_history.sync() # so that a copy from another instance is found with its segments
+			key = paste_history.add(text, segments_of(strings, line_ending) if strings else None)
+		clipboard_fingerprint, clipboard_key = fingerprint, key
+	return text
+
+class ClipboardPublisher(object):
+	# Puts what cut and copy captured on the clipboard and into paste history,
+	# and reports it in the status bar. With copy_edit_async_clipboard on this
+	# happens on the async thread, so that the editor doesn't wait for the
+	# system clipboard to take a huge copy; publications are done one at a
+	# time in the order the commands ran. Anything that reads the clipboard
+	# or paste history calls flush() first, which finishes the pending ones.
+	#
+	# With copy_edit_lazy_clipboard on, nothing is published until the view
+	# loses focus, a flush is asked for, or no copy has been made for
+	# copy_edit_lazy_clipboard_delay ms. Until then the copy is only in
+	# selection_strings, which pastes use as is (see authoritative()).
+	def __init__(self):
+		self.pending = collections.deque()
+		self.lock = threading.Lock()          # guards pending and lazy
+		self.publish_lock = threading.RLock() # held while publishing
+		self.lazy = False       # whether pending holds a copy no one has seen on the clipboard yet
+		self.generation = 0     # of the last lazy publish, so that only its idle timeout flushes
+
+	def publish(self, strings, line_ending, verb):
+		if preference("copy_edit_lazy_clipboard", False):
+			print_status_message(verb, None, strings)
+			with self.lock:
+				self.pending.append((strings, line_ending, None))
+				self.lazy = True
+				self.generation += 1
+				generation = self.generation
+			set_timeout = sublime.set_timeout_async if preference("copy_edit_async_clipboard", False) else sublime.set_timeout
+			set_timeout(lambda: self.flush_idle(generation), preference("copy_edit_lazy_clipboard_delay", 1000))
+			return
+		with self.lock:
+			self.pending.append((strings, line_ending, verb))
+		if preference("copy_edit_async_clipboard", False):
+			sublime.set_timeout_async(self.flush, 0)
+		else:
+			self.flush()
+
+	def authoritative(self):
+		# Whether the last copy is still unpublished, so that the clipboard
+		# can't hold anything newer and selection_strings is what to paste.
+		return self.lazy
+
+	def flush_idle(self, generation):
+		if generation == self.generation:
+			self.flush()
+
+	def flush(self):
+		with self.publish_lock:
+			while True:
+				with self.lock:
+					if not self.pending:
+						self.lazy = False
+						return
+					strings, line_ending, verb = self.pending.popleft()
+				sublime.set_clipboard(remember_clipboard(clipboard_text(strings, line_ending), strings, line_ending))
+				if verb is not None:
+					print_status_message(verb, None, strings)
+
+clipboard_publisher = ClipboardPublisher()
+
+class CopyEditFlushClipboardCommand(sublime_plugin.ApplicationCommand):
+	def run(self):
+		clipboard_publisher.flush()
+
+def clipboard_is_remembered(text):
+	with paste_history.lock:
+		if (len(text), hash(text)) == clipboard_fingerprint:
+			paste_history.touch(clipboard_key)
+			return True
+	return False
+
 class PasteFromHistoryIdxCommand(sublime_plugin.TextCommand):
+	@instrumented("paste_from_history", None)
 	def run(self, edit, idx):
 		if idx != -1:
-			sublime.set_clipboard(paste_history_deque[idx])
+			clipboard_publisher.flush()
+			sublime.set_clipboard(paste_history[idx])
 			self.view.run_command("paste_edit")
 
 class PasteFromHistoryEditCommand(sublime_plugin.TextCommand):
+	@instrumented("history_menu", None)
 	def run(self, edit):
-		add_string_to_paste_history(sublime.get_clipboard()) # this is needed when string was copied to clipboard not within Sublime Text
-		if len(paste_history_deque) > 0:
-			(self.view.window().show_quick_panel if self.view.settings().get("paste_from_history_quick_panel") else self.view.show_popup_menu)(
-				[(s if len(s) < 45 else s[:45] + '...').replace("\n", " ").replace("\t", " ") for s in paste_history_deque],
-				lambda idx: self.view.run_command("paste_from_history_idx", {"idx": idx}))
+		clipboard_publisher.flush()
+		configure_paste_history()
+		paste_history.load()
+		pasteboard = sublime.get_clipboard()
+		if not clipboard_is_remembered(pasteboard):
+			add_string_to_paste_history(pasteboard) # this is needed when string was copied to clipboard not within Sublime Text
+		if len(paste_history) > 0:
+			self.show_page(0)
+
+	def show_page(self, start):
+		# Long histories are shown a page at a time, so that the list opens
+		# just as fast however many entries there are.
+		page_size = max(preference("paste_from_history_page_size", 50), 1)
+		items, total = paste_history.page(start, page_size)
+		more = total - start - len(items)
+		if more > 0:
+			items.append("... {0} more".format(more))
+		def on_select(idx):
+			if more > 0 and idx == len(items) - 1:
+				sublime.set_timeout(lambda: self.show_page(start + page_size), 0)
+			else:
+				self.view.run_command("paste_from_history_idx", {"idx": idx if idx == -1 else start + idx})
+		(self.view.window().show_quick_panel if self.view.settings().get("paste_from_history_quick_panel") else self.view.show_popup_menu)(items, on_select)
+
+class PasteFromHistorySearchCommand(sublime_plugin.TextCommand):
+	# Asks for a piece of text and lists the history entries containing it.
+	@instrumented("history_search", None)
+	def run(self, edit):
+		clipboard_publisher.flush()
+		configure_paste_history()
+		paste_history.load()
+		pasteboard = sublime.get_clipboard()
+		if not clipboard_is_remembered(pasteboard):
+			add_string_to_paste_history(pasteboard)
+		window = self.view.window()
+		window.show_input_panel("Search paste history:", "", self.show_matches, self.show_count, None)
+
+	def show_count(self, query):
+		# Runs on every keystroke, so it waits until the trigram index can narrow the search down.
+		if len(query) < 3:
+			sublime.status_message("Type 3 or more characters to see how many paste history entries match")
+		else:
+			sublime.status_message("{0} matching paste history entries".format(len(paste_history.search(query))))
+
+	def show_matches(self, query):
+		matches = paste_history.previews(paste_history.search(query))
+		if not matches:
+			sublime.status_message("No paste history entries contain " + query)
+			return
+		def on_select(idx):
+			text = paste_history.text(matches[idx][0]) if idx != -1 else None
+			if text is not None:
+				sublime.set_clipboard(text)
+				self.view.run_command("paste_edit")
+		self.view.window().show_quick_panel([preview for key, preview in matches], on_select)
+
+class DeletedText(object):
+	# Text removed by left_delete/right_delete goes to paste history once the
+	# user stops deleting, as one entry per run of deletes: consecutive deletes
+	# at the same carets are merged (backspacing over a word gives the word),
+	# every selection contributes (joined by \n, like copy), and runs that
+	# removed at most one character per caret are dropped.
+	delay = 1000 # ms without deletes after which the run goes to history
+
+	def __init__(self):
+		self.view_id = None
+		self.parts = []    # text removed at each caret during this run
+		self.expected = [] # where each caret is after the last delete
+		self.generation = 0
+		self.lock = threading.Lock() # the run is ended from the async thread too
+
+	def capture(self, view, command_name):
+		regions = [(s.begin(), s.end()) for s in view.sel()]
+		finished = None
+		with self.lock:
+			if view.id() != self.view_id or [begin for begin, end in regions] != self.expected:
+				finished = self.take()
+				self.view_id = view.id()
+				self.parts = [""] * len(regions)
+			left = command_name == "left_delete"
+			self.expected = []
+			removed = 0
+			for i, (begin, end) in enumerate(regions):
+				if begin == end:
+					begin, end = (max(begin - 1, 0), begin) if left else (begin, min(begin + 1, view.size()))
+				text = view.substr(sublime.Region(begin, end))
+				self.parts[i] = text + self.parts[i] if left else self.parts[i] + text
+				self.expected.append(begin - removed)
+				removed += end - begin
+			self.generation += 1
+			generation = self.generation
+		self.add(finished)
+		sublime.set_timeout_async(lambda: self.flush(generation), self.delay)
+
+	def take(self): # ends the run; the lock must be held
+		parts = self.parts
+		self.view_id = None
+		self.parts = []
+		self.expected = []
+		return parts
+
+	def flush(self, generation = None):
+		# Ends the run; with `generation`, only if no delete came after the one it is of.
+		with self.lock:
+			if generation is not None and generation != self.generation:
+				return
+			parts = self.take()
+		self.add(parts)
+
+	@staticmethod
+	def add(parts):
+		if parts and max(len(p) for p in parts) > 1:
+			with clipboard_publisher.publish_lock: # not at the same time as a copy going to history
+				add_string_to_paste_history("\n".join(parts))
+
+deleted_text = DeletedText()
 
 class CopyEditListener(sublime_plugin.EventListener): # for support of standard main menu commands (Edit:Cut/Copy/Paste)
+    @instrumented("on_text_command", None)
     def on_text_command(self, view, command_name, args):
+        if command_name in ["undo", "redo"]:
+            steps = ChunkedPaste.undo_steps.pop(view.id(), None)
+            if steps is not None and steps[0] == command_name and steps[2] == view.change_count():
+                return ("undo_paste_chunks_edit", {"command": command_name, "times": steps[1]})
+        if command_name in ["left_delete", "right_delete"]:
+            deleted_text.capture(view, command_name)
+            return
+        deleted_text.flush() # any other command ends the run, and history must get it before a copy
         if command_name in ["cut", "copy", "paste", "paste_from_history"]: # actually adding "paste_from_history" here does not make any sense because this command is disabled after startup of SublimeText
             return (command_name + "_edit", args)
-        if command_name in ["left_delete", "right_delete"]:
-        	add_string_to_paste_history(view.substr(view.sel()[0]))
+
+    def on_deactivated(self, view):
+        clipboard_publisher.flush() # a copy kept back by copy_edit_lazy_clipboard must be on the clipboard before another application may paste it
+
+    def on_close(self, view):
+        ChunkedPaste.running.pop(view.id(), None)
+        ChunkedPaste.undo_steps.pop(view.id(), None)
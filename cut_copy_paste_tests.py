@@ -1,11 +1,16 @@
 # To run this tests just put this script file under SublimeText Packages folder
 # and in SublimeText Console enter this command:
 # sublime.run_command("cut_copy_paste_tests")
+# They also run outside of SublimeText, see tests/test_cut_copy_paste.py.
 
 import sublime, sublime_plugin, re
 
 class cut_copy_paste_tests_command(sublime_plugin.ApplicationCommand):
     def run(self):
+        if self.run_tests():
+            self.run_tests_neo()
+
+    def run_tests(self): # returns True if all tests passed
         # These tests are quite human-readable, but not so human-writable (: as it may seems :). But this is intentional, as in
         # case of small typo exception is raised instead of "smart" guessing what you possibly wanted, and running without fail
         # [and may be even improperly showing test as CORRECTly passed whilst it was INcorrectly parsed].
@@ -348,10 +353,12 @@ This is CORRECT result:
                     break
             print(test_id + ' ' + (compared_result_type if compared_result_type else "INCORRECT"))
             if not compared_result_type:
-                return # to skip buffer.close() call
+                return False # to skip buffer.close() call
 
         buffer.close()
+        return True
 
+    def run_tests_neo(self): # returns True if all tests passed
         # Those tests_neo (below) allow do testing much more accurately, and they can also check cursor/selection position after command was executed
         tests_neo = """
 TN 0 // Test Number 0 — basic syntax [of this new language for tests] tests/checks
@@ -553,17 +560,18 @@ CR‘1
                 if cmd == "IR":
                     if new_data == data:
                         print("incorrect result detected (command: IR‘"+data+"’)")
-                        return # to skip buffer.close() call
+                        return False # to skip buffer.close() call
                 else:
                     assert(cmd == "CR")
                     if new_data != data:
                         print("check result failed (command: CR‘"+data+"’)")
-                        return # to skip buffer.close() call
+                        return False # to skip buffer.close() call
             else:
                 raise 'Unknown command ' + cmd
 
         switch_test()
         buffer.close()
+        return True
 
 
 class split_selection_into_characters(sublime_plugin.TextCommand):
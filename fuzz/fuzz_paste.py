@@ -0,0 +1,172 @@
+# Differential fuzzer for paste, run against the headless stand-in of the
+# Sublime API (see headless/):
+#
+#     python fuzz/fuzz_paste.py                      # 100k random cases over all cores
+#     python fuzz/fuzz_paste.py --cases 5000 --seed 7 --jobs 1
+#
+# Each case is a buffer, a set of selections and the (text, whole_line)
+# strings of a copy. It is pasted once with PasteEditCommand and once with
+# `reference_paste`, the original selection-by-selection algorithm, and the
+# resulting buffers and selections must be the same. Cases where they differ
+# are shrunk to a minimal one before being reported. The exit status is 1
+# when any case failed.
+
+import os, sys, random, argparse, multiprocessing
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, "headless"), root]
+
+import sublime, sublime_plugin, copy_edit
+
+def reference_paste(view, edit, selection_strings):
+	# PasteEditCommand.run before paste plans, minus the clipboard check.
+	numstrings = len(selection_strings)
+	numsels = len(view.sel())
+	if numsels == 1: # To fix TN 7
+		selection_strings = [(("" if selection_strings[0][1] else "\n").join([s[0] for s in selection_strings]), selection_strings[0][1])]
+		numstrings = 1
+	strs_per_sel = copy_edit.strings_per_selection(numsels, numstrings)
+	if numsels == numstrings or numstrings == 1:
+		sel_strings = iter(selection_strings)
+		string = next(sel_strings)
+		for sel in view.sel():
+			replace_region = sublime.Region(view.line(sel.begin()).begin()) if string[1] and sel.size() == 0 else sel
+			view.replace(edit, replace_region, string[0])
+			string = next(sel_strings, None)
+			if string is None:
+				sel_strings = iter(selection_strings)
+				string = next(sel_strings)
+	else:
+		str_index = 0
+		for sel in view.sel():
+			view.erase(edit, sel)
+			insertion_point = sel.begin()
+			for string in selection_strings[str_index:str_index + strs_per_sel]:
+				view.insert(edit, view.line(insertion_point).begin() if string[1] else insertion_point, string[0])
+				insertion_point += len(string[0])
+			str_index = (str_index + strs_per_sel) % numstrings
+	carets = [sublime.Region(s.end()) for s in view.sel()]
+	view.sel().clear()
+	for s in carets:
+		view.sel().add(s)
+
+def plugin_paste(view, edit, selection_strings):
+	copy_edit.selection_strings[:] = selection_strings
+	sublime.set_clipboard(copy_edit.remember_clipboard(copy_edit.clipboard_text(selection_strings, "\n"), selection_strings))
+	copy_edit.PasteEditCommand(view).run(edit)
+
+def outcome(paste, case):
+	# The buffer and selections after pasting `case` with `paste`.
+	text, regions, strings = case
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": text})
+	view.sel().add_all([sublime.Region(a, b) for a, b in regions])
+	paste(view, sublime_plugin._Edit(), list(strings))
+	result = (view.substr(sublime.Region(0, view.size())), [(r.a, r.b) for r in view.sel()])
+	view.close()
+	return result
+
+def fails(case, paste = plugin_paste):
+	return outcome(paste, case) != outcome(reference_paste, case)
+
+def random_case(rng):
+	def text(n):
+		return "".join(rng.choice("ab\n") for _ in range(n))
+	if rng.random() < 0.2: # enough selections for the single-span rewrite in apply_paste()
+		buffer = text(rng.randint(40, 120))
+		points = sorted(rng.sample(range(len(buffer) + 1), rng.randint(30, 41)))
+	else:
+		buffer = text(rng.randint(0, 30))
+		points = sorted(rng.sample(range(len(buffer) + 1), min(len(buffer) + 1, rng.randint(1, 8))))
+	regions = []
+	i = 0
+	while i < len(points):
+		if i + 1 < len(points) and rng.random() < 0.5:
+			regions.append((points[i], points[i + 1]))
+			i += 2
+		else:
+			regions.append((points[i], points[i]))
+			i += 1
+	strings = []
+	for _ in range(rng.randint(1, 5)):
+		if rng.random() < 0.4:
+			strings.append((text(rng.randint(0, 4)).replace("\n", "") + "\n", True)) # copied with an empty selection
+		else:
+			strings.append((text(rng.randint(0, 4)), False))
+	return buffer, regions, strings
+
+def smaller(case):
+	# Cases one step simpler than `case`.
+	text, regions, strings = case
+	for i in range(len(regions)):
+		if len(regions) > 1:
+			yield text, regions[:i] + regions[i + 1:], strings
+		a, b = regions[i]
+		if a != b:
+			yield text, regions[:i] + [(a, a)] + regions[i + 1:], strings
+	for i in range(len(strings)):
+		if len(strings) > 1:
+			yield text, regions, strings[:i] + strings[i + 1:]
+		s, whole_line = strings[i]
+		if len(s) > whole_line:
+			yield text, regions, strings[:i] + [(s[1:], whole_line)] + strings[i + 1:]
+	for i in range(len(text)):
+		shift = lambda p: p - 1 if p > i else p
+		yield text[:i] + text[i + 1:], [(shift(a), shift(b)) for a, b in regions], strings
+
+def minimize(case, still_fails = fails):
+	# Greedily takes simpler cases for as long as they still fail.
+	while True:
+		for simpler in smaller(case):
+			if still_fails(simpler):
+				case = simpler
+				break
+		else:
+			return case
+
+def run_chunk(job):
+	# Runs `count` cases from `seed`; returns (cases run, minimized failures).
+	seed, count, max_failures = job
+	rng = random.Random(seed)
+	failures = []
+	for _ in range(count):
+		case = random_case(rng)
+		if fails(case):
+			failures.append(minimize(case))
+			if len(failures) >= max_failures:
+				break
+	return count, failures
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "CopyEdit paste differential fuzzer")
+	parser.add_argument("--cases", type = int, default = 100000)
+	parser.add_argument("--seed", type = int, default = 0)
+	parser.add_argument("--jobs", type = int, default = 0, help = "worker processes (default: one per core)")
+	parser.add_argument("--chunk", type = int, default = 2000, help = "cases per job")
+	parser.add_argument("--max-failures", type = int, default = 5, help = "stop a job after this many failures")
+	args = parser.parse_args(argv)
+
+	jobs = [(args.seed * 1000003 + i, min(args.chunk, args.cases - start), args.max_failures) for i, start in enumerate(range(0, args.cases, args.chunk))]
+	processes = args.jobs or multiprocessing.cpu_count()
+	if processes == 1:
+		results = map(run_chunk, jobs)
+	else:
+		pool = multiprocessing.Pool(processes)
+		results = pool.imap_unordered(run_chunk, jobs)
+
+	total = 0
+	failures = set()
+	for count, found in results:
+		total += count
+		failures.update(repr(case) for case in found)
+	if processes != 1:
+		pool.close()
+		pool.join()
+
+	for case in sorted(failures, key = len):
+		print("FAIL " + case)
+	print("{0} cases, {1} distinct minimized failures".format(total, len(failures)))
+	return 1 if failures else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,514 @@
+# In-process stand-in for the parts of Sublime Text's `sublime` module used by
+# CopyEdit and its tests. Put this directory on sys.path before importing
+# copy_edit (see tests/conftest.py).
+
+import re, os, tempfile, bisect
+
+LITERAL = 1
+IGNORECASE = 2
+
+_clipboard = ""
+_status = ""
+_timeouts = []
+_settings = {}
+_windows = []
+_next_id = [1]
+
+def _new_id():
+	_next_id[0] += 1
+	return _next_id[0]
+
+def version():
+	return "4000"
+
+def platform():
+	return "linux"
+
+def cache_path():
+	path = os.path.join(tempfile.gettempdir(), "sublime-headless-cache")
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	return path
+
+def get_clipboard(size_limit = 16777216):
+	return _clipboard
+
+def set_clipboard(text):
+	global _clipboard
+	_clipboard = text
+
+def status_message(msg):
+	global _status
+	_status = msg
+
+def last_status_message():
+	return _status
+
+def set_timeout(callback, delay = 0):
+	_timeouts.append(callback)
+
+set_timeout_async = set_timeout
+
+def run_timeouts():
+	"Run queued set_timeout/set_timeout_async callbacks (and the ones they queue) in order."
+	while _timeouts:
+		_timeouts.pop(0)()
+
+def run_command(cmd, args = None):
+	import sublime_plugin
+	sublime_plugin.run_application_command(cmd, args)
+
+def load_settings(base_name):
+	if base_name not in _settings:
+		_settings[base_name] = Settings()
+	return _settings[base_name]
+
+def save_settings(base_name):
+	pass
+
+def active_window():
+	if not _windows:
+		_windows.append(Window())
+	return _windows[0]
+
+def windows():
+	return list(_windows)
+
+def reset():
+	"Forget clipboard, status, pending timeouts, settings and windows."
+	global _clipboard, _status
+	_clipboard = ""
+	_status = ""
+	del _timeouts[:]
+	_settings.clear()
+	del _windows[:]
+
+class Region(object):
+	__slots__ = ('a', 'b', 'xpos')
+
+	def __init__(self, a, b = None, xpos = -1):
+		if b is None:
+			b = a
+		self.a = a
+		self.b = b
+		self.xpos = xpos
+
+	def __repr__(self):
+		return "Region({0}, {1})".format(self.a, self.b)
+
+	def __len__(self):
+		return self.size()
+
+	def __eq__(self, other):
+		return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.a, self.b))
+
+	def begin(self):
+		return min(self.a, self.b)
+
+	def end(self):
+		return max(self.a, self.b)
+
+	def size(self):
+		return abs(self.b - self.a)
+
+	def empty(self):
+		return self.a == self.b
+
+	def contains(self, x):
+		if isinstance(x, Region):
+			return self.begin() <= x.begin() and x.end() <= self.end()
+		return self.begin() <= x <= self.end()
+
+	def intersects(self, other):
+		return self.begin() < other.end() and other.begin() < self.end() or self == other
+
+	def cover(self, other):
+		return Region(min(self.begin(), other.begin()), max(self.end(), other.end()))
+
+def _mergeable(r, s):
+	# Regions that overlap, coincide, or where a caret touches the other one
+	# are merged by Sublime; adjacent non-empty regions stay separate.
+	if r.begin() < s.end() and s.begin() < r.end():
+		return True
+	if r.empty() or s.empty():
+		return s.begin() <= r.end() and r.begin() <= s.end()
+	return False
+
+def _normalized(regions):
+	regions = sorted(regions, key = lambda r: (r.begin(), r.end()))
+	result = []
+	for r in regions:
+		if result and _mergeable(result[-1], r):
+			result[-1] = result[-1].cover(r)
+		else:
+			result.append(Region(r.a, r.b))
+	return result
+
+class Selection(object):
+	def __init__(self, view):
+		self._view = view
+		self._regions = []
+
+	def _live(self):
+		self._view._flush_selection()
+		return self._regions
+
+	def __len__(self):
+		return len(self._live())
+
+	def __getitem__(self, index):
+		r = self._live()[index]
+		return Region(r.a, r.b)
+
+	def __iter__(self):
+		i = 0
+		while i < len(self):
+			yield self[i]
+			i += 1
+
+	def clear(self):
+		self._view._sel_edits = []
+		self._regions = []
+
+	def add(self, region):
+		regions = self._live()
+		if isinstance(region, int):
+			region = Region(region)
+		if not regions or (regions[-1].end() < region.begin() or
+			(regions[-1].end() == region.begin() and not regions[-1].empty() and not region.empty())):
+			regions.append(Region(region.a, region.b))
+		else:
+			self._regions = _normalized(regions + [region])
+
+	def add_all(self, regions):
+		self._regions = _normalized(self._live() + [r if isinstance(r, Region) else Region(r) for r in regions])
+
+	def contains(self, region):
+		return any(r.contains(region) for r in self._live())
+
+class Settings(object):
+	def __init__(self, parent = None, values = None):
+		self._parent = parent
+		self._values = dict(values or {})
+
+	def get(self, name, default = None):
+		if name in self._values:
+			return self._values[name]
+		if self._parent is not None:
+			return self._parent.get(name, default)
+		return default
+
+	def set(self, name, value):
+		self._values[name] = value
+
+	def erase(self, name):
+		self._values.pop(name, None)
+
+	def has(self, name):
+		return name in self._values or self._parent is not None and self._parent.has(name)
+
+_default_view_settings = {"copy_with_empty_selection": True}
+
+def _shift(e, x, y, length):
+	# Where point `e` ends up when [x, y) is replaced by `length` characters.
+	if e < x:
+		return e
+	if x == y:
+		return e + length
+	if e == x:
+		return x
+	if e <= y:
+		return x + length
+	return e + length - (y - x)
+
+class View(object):
+	def __init__(self, window = None):
+		self._id = _new_id()
+		self._window = window
+		self._text = ""
+		self._edits = []     # pending (x, y, text) edits not yet applied to self._text
+		self._sel_edits = [] # pending (x, y, length) edits not yet applied to the selection
+		self._size = 0
+		self._change_count = 0
+		self._line_endings = "Unix"
+		self._scratch = False
+		self._read_only = False
+		self._closed = False
+		self._undo = [] # (text, pending edits, size) before each text command that changed the buffer
+		self._redo = []
+		self._sel = Selection(self)
+		self._settings = Settings(load_settings("Preferences.sublime-settings"), _default_view_settings)
+
+	def __repr__(self):
+		return "View({0})".format(self._id)
+
+	def __eq__(self, other):
+		return isinstance(other, View) and self._id == other._id
+
+	def __hash__(self):
+		return self._id
+
+	def id(self):
+		return self._id
+
+	def buffer_id(self):
+		return self._id
+
+	def window(self):
+		return self._window
+
+	def is_valid(self):
+		return not self._closed
+
+	def close(self):
+		self._closed = True
+		if self._window and self in self._window._views:
+			self._window._views.remove(self)
+		return True
+
+	def set_scratch(self, scratch):
+		self._scratch = scratch
+
+	def is_scratch(self):
+		return self._scratch
+
+	def set_read_only(self, read_only):
+		self._read_only = read_only
+
+	def is_read_only(self):
+		return self._read_only
+
+	def settings(self):
+		return self._settings
+
+	def line_endings(self):
+		return self._line_endings
+
+	def set_line_endings(self, line_ending):
+		self._line_endings = line_ending
+
+	def change_count(self):
+		return self._change_count
+
+	def sel(self):
+		return self._sel
+
+	def size(self):
+		return self._size
+
+	# Edits are queued and applied lazily, so that a batch of edits made in
+	# document order (either direction) costs one pass over the buffer.
+
+	def _record(self, x, y, text):
+		assert 0 <= x <= y <= self._size, "edit {0} out of range".format((x, y))
+		self._edits.append((x, y, text))
+		self._sel_edits.append((x, y, len(text)))
+		self._size += len(text) - (y - x)
+		self._change_count += 1
+
+	@staticmethod
+	def _monotonic(edits):
+		# Returns the edits in original (pre-batch) coordinates, ascending, if
+		# they were made strictly front-to-back or back-to-front; else None.
+		if len(edits) < 2:
+			return list(edits)
+		if all(edits[i][1] <= edits[i-1][0] and (edits[i][0] < edits[i-1][0] or edits[i-1][0] < edits[i-1][1]) for i in range(1, len(edits))):
+			return edits[::-1]
+		result = []
+		delta = 0
+		prev_end = -1
+		for x, y, n in edits:
+			if x < prev_end:
+				return None
+			result.append((x - delta, y - delta, n))
+			length = n if isinstance(n, int) else len(n)
+			prev_end = x + length
+			delta += length - (y - x)
+		return result
+
+	def _flush_text(self):
+		if not self._edits:
+			return
+		edits = self._monotonic(self._edits)
+		if edits is None:
+			text = self._text
+			for x, y, s in self._edits:
+				text = text[:x] + s + text[y:]
+		else:
+			parts = []
+			pos = 0
+			for x, y, s in edits:
+				parts.append(self._text[pos:x])
+				parts.append(s)
+				pos = y
+			parts.append(self._text[pos:])
+			text = "".join(parts)
+		self._text = text
+		self._edits = []
+
+	def _flush_selection(self):
+		if not self._sel_edits:
+			return
+		regions = self._sel._regions
+		edits = self._monotonic(self._sel_edits)
+		if edits is None:
+			for x, y, n in self._sel_edits:
+				for r in regions:
+					r.a = _shift(r.a, x, y, n)
+					r.b = _shift(r.b, x, y, n)
+		else:
+			starts = [e[0] for e in edits]
+			deltas = [0]
+			for x, y, n in edits:
+				deltas.append(deltas[-1] + n - (y - x))
+			def move(e):
+				j = bisect.bisect_right(starts, e) - 1
+				if j < 0:
+					return e
+				x, y, n = edits[j]
+				return _shift(e, x, y, n) + deltas[j]
+			for r in regions:
+				r.a = move(r.a)
+				r.b = move(r.b)
+		self._sel_edits = []
+
+	# Undo restores the text as it was before a text command; selections are
+	# left as they are.
+
+	def _snapshot(self):
+		return (self._text, list(self._edits), self._size)
+
+	def _restore(self, snapshot):
+		self._text, edits, self._size = snapshot
+		self._edits = list(edits)
+		self._sel_edits = []
+		self._change_count += 1
+		self._sel._regions = [Region(min(r.a, self._size), min(r.b, self._size)) for r in self._sel._regions]
+
+	def _text_now(self):
+		self._flush_text()
+		return self._text
+
+	def substr(self, x):
+		text = self._text_now()
+		if isinstance(x, Region):
+			return text[x.begin():x.end()]
+		return text[x:x+1]
+
+	def _line(self, begin, end):
+		text = self._text_now()
+		return Region(text.rfind("\n", 0, begin) + 1, (lambda e: len(text) if e == -1 else e)(text.find("\n", end)))
+
+	def line(self, x):
+		if isinstance(x, Region):
+			return self._line(x.begin(), x.end())
+		return self._line(x, x)
+
+	def full_line(self, x):
+		r = self.line(x)
+		return Region(r.a, min(r.b + 1, self._size))
+
+	def lines(self, region):
+		result = []
+		r = self.line(region.begin())
+		while True:
+			result.append(r)
+			if r.b >= region.end() or r.b >= self._size:
+				return result
+			r = self.line(r.b + 1)
+
+	def rowcol(self, point):
+		text = self._text_now()
+		row = text.count("\n", 0, point)
+		return (row, point - (text.rfind("\n", 0, point) + 1))
+
+	def text_point(self, row, col):
+		text = self._text_now()
+		pos = 0
+		for _ in range(row):
+			pos = text.find("\n", pos) + 1
+		return pos + col
+
+	def find(self, pattern, start_pt, flags = 0):
+		text = self._text_now()
+		if flags & LITERAL:
+			pattern = re.escape(pattern)
+		m = re.compile(pattern, re.MULTILINE | (re.IGNORECASE if flags & IGNORECASE else 0)).search(text, start_pt)
+		return Region(m.start(), m.end()) if m else Region(-1, -1)
+
+	def find_all(self, pattern, flags = 0):
+		text = self._text_now()
+		if flags & LITERAL:
+			pattern = re.escape(pattern)
+		return [Region(m.start(), m.end()) for m in re.finditer(pattern, text, re.MULTILINE | (re.IGNORECASE if flags & IGNORECASE else 0))]
+
+	# Like Sublime, edits of a read-only view are ignored.
+
+	def insert(self, edit, point, text):
+		assert edit is not None
+		if self._read_only:
+			return 0
+		self._record(point, point, text)
+		return len(text)
+
+	def erase(self, edit, region):
+		assert edit is not None
+		if region.size() and not self._read_only:
+			self._record(region.begin(), region.end(), "")
+
+	def replace(self, edit, region, text):
+		assert edit is not None
+		if not self._read_only:
+			self._record(region.begin(), region.end(), text)
+
+	def run_command(self, cmd, args = None):
+		import sublime_plugin
+		sublime_plugin._run_text_command(self, cmd, args or {})
+
+	def show_popup_menu(self, items, on_select, flags = 0):
+		if self._window:
+			self._window._show(items, on_select)
+
+class Window(object):
+	def __init__(self):
+		self._id = _new_id()
+		self._views = []
+		self._panel = None
+		self.on_panel = None # set by tests to pick an entry: called with (items, on_select)
+		self.on_input = None # set by tests to answer input panels: called with (caption, initial_text, on_done, on_change, on_cancel)
+
+	def id(self):
+		return self._id
+
+	def new_file(self):
+		view = View(self)
+		self._views.append(view)
+		return view
+
+	def views(self):
+		return list(self._views)
+
+	def active_view(self):
+		return self._views[-1] if self._views else None
+
+	def run_command(self, cmd, args = None):
+		import sublime_plugin
+		sublime_plugin._run_window_command(self, cmd, args or {})
+
+	def _show(self, items, on_select):
+		self._panel = (items, on_select)
+		if self.on_panel:
+			self.on_panel(items, on_select)
+
+	def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+		if self.on_input:
+			self.on_input(caption, initial_text, on_done, on_change, on_cancel)
+
+	def show_quick_panel(self, items, on_select, flags = 0, selected_index = -1, on_highlight = None):
+		self._show(items, on_select)
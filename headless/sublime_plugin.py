@@ -0,0 +1,162 @@
+# In-process stand-in for Sublime Text's `sublime_plugin` module: command
+# classes register themselves by name, event listeners are instantiated on
+# definition, and `on_text_command` is dispatched the way the editor does it.
+
+import re, sublime
+
+text_commands = {}
+window_commands = {}
+application_commands = {}
+event_listeners = {}
+
+def _command_name(cls):
+	name = cls.__name__
+	if name.endswith("Command"):
+		name = name[:-len("Command")]
+	elif name.endswith("_command"):
+		name = name[:-len("_command")]
+	return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name).lower()
+
+class Command(object):
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		registry = cls._registry()
+		if registry is not None and cls.__module__ != __name__:
+			registry[_command_name(cls)] = cls
+
+	@classmethod
+	def _registry(cls):
+		return None
+
+	def name(self):
+		return _command_name(type(self))
+
+	def is_enabled(self, *args):
+		return True
+
+	def is_visible(self, *args):
+		return True
+
+class ApplicationCommand(Command):
+	@classmethod
+	def _registry(cls):
+		return application_commands
+
+class WindowCommand(Command):
+	def __init__(self, window):
+		self.window = window
+
+	@classmethod
+	def _registry(cls):
+		return window_commands
+
+class TextCommand(Command):
+	def __init__(self, view):
+		self.view = view
+
+	@classmethod
+	def _registry(cls):
+		return text_commands
+
+class EventListener(object):
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		# Keyed by qualified name so that re-importing a plugin replaces its listeners.
+		event_listeners[cls.__module__ + "." + cls.__qualname__] = cls()
+
+class ViewEventListener(object):
+	def __init__(self, view):
+		self.view = view
+
+def _listeners(method):
+	return [l for l in list(event_listeners.values()) if hasattr(l, method)]
+
+def on_text_command(view_id, name, args):
+	view = _view_by_id(view_id)
+	for listener in _listeners("on_text_command"):
+		res = listener.on_text_command(view, name, args)
+		if isinstance(res, tuple):
+			return res
+		elif res:
+			return (res, None)
+	return ("", None)
+
+def on_deactivated(view):
+	for listener in _listeners("on_deactivated"):
+		listener.on_deactivated(view)
+
+def on_activated(view):
+	for listener in _listeners("on_activated"):
+		listener.on_activated(view)
+
+def _view_by_id(view_id):
+	for window in sublime.windows():
+		for view in window.views():
+			if view.id() == view_id:
+				return view
+	raise KeyError(view_id)
+
+class _Edit(object):
+	pass
+
+def _run_text_command(view, name, args):
+	# Every text command that changes the buffer is one undo step.
+	before = view._snapshot()
+	change_count = view.change_count()
+	if name in text_commands:
+		text_commands[name](view).run(_Edit(), **args)
+	elif name in _builtin_text_commands:
+		_builtin_text_commands[name](view, _Edit(), **args)
+	else:
+		raise KeyError("unknown text command: " + name)
+	if name not in ("undo", "redo") and view.change_count() != change_count:
+		view._undo.append(before)
+		view._redo = []
+
+def _run_window_command(window, name, args):
+	if name in window_commands:
+		window_commands[name](window).run(**args)
+	elif name in text_commands and window.active_view():
+		_run_text_command(window.active_view(), name, args)
+	else:
+		raise KeyError("unknown window command: " + name)
+
+def run_application_command(name, args = None):
+	application_commands[name]().run(**(args or {}))
+
+# Built-in editor commands used by the test suites
+
+def _select_all(view, edit):
+	view.sel().clear()
+	view.sel().add(sublime.Region(0, view.size()))
+
+def _delete(view, edit, forward):
+	for i in range(len(view.sel())):
+		r = view.sel()[i]
+		if r.empty():
+			r = sublime.Region(r.a, min(r.a + 1, view.size())) if forward else sublime.Region(max(r.a - 1, 0), r.a)
+		view.erase(edit, r)
+
+def _undo(view, edit, redo = False):
+	done, undone = (view._redo, view._undo) if redo else (view._undo, view._redo)
+	if done and not view._read_only:
+		undone.append(view._snapshot())
+		view._restore(done.pop())
+
+def _append(view, edit, characters, force = False, scroll_to_end = False):
+	view.insert(edit, view.size(), characters)
+
+def _insert(view, edit, characters):
+	for i in range(len(view.sel())):
+		r = view.sel()[i]
+		view.replace(edit, r, characters)
+
+_builtin_text_commands = {
+	"select_all": _select_all,
+	"left_delete": lambda view, edit: _delete(view, edit, False),
+	"right_delete": lambda view, edit: _delete(view, edit, True),
+	"undo": _undo,
+	"redo": lambda view, edit: _undo(view, edit, True),
+	"append": _append,
+	"insert": _insert,
+}
@@ -0,0 +1,26 @@
+# Runs CopyEdit and its test suites under plain CPython, with the stand-in
+# `sublime` and `sublime_plugin` modules from headless/.
+
+import os, sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(root, "headless"), root]
+
+import pytest, sublime, copy_edit
+
+@pytest.fixture(autouse = True)
+def fresh_state():
+	copy_edit.clipboard_publisher.flush()
+	sublime.reset()
+	copy_edit.selection_strings[:] = []
+	copy_edit.paste_history.clear()
+	copy_edit.paste_history.log = None
+	copy_edit.configure_paste_history() # closes a shared history left open
+	copy_edit.clipboard_fingerprint = None
+	copy_edit.clipboard_key = None
+	copy_edit.deleted_text.flush()
+	copy_edit.stats.ops.clear()
+	copy_edit.ChunkedPaste.running.clear()
+	copy_edit.ChunkedPaste.undo_steps.clear()
+	yield
+	copy_edit.paste_history.clear()
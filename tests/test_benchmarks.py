@@ -0,0 +1,13 @@
+import os, sys, json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import bench_copy_edit
+
+def test_quick_sweep_runs(tmpdir, capsys):
+	baselines = str(tmpdir.join("baselines.json"))
+	assert bench_copy_edit.main(["--filter", "/100/1024/", "--repeat", "1", "--baselines", baselines, "--save"]) == 0
+	with open(baselines) as f:
+		results = json.load(f)
+	assert set(key.split("/")[0] for key in results) == set(name for name, shape in bench_copy_edit.SHAPES)
+	assert all(result["seconds"] > 0 and result["peak_bytes"] > 0 for result in results.values())
@@ -0,0 +1,510 @@
+import os, sys, hashlib, zlib, threading, pytest, sublime, sublime_plugin, copy_edit, cut_copy_paste_tests
+
+def test_tests():
+	assert cut_copy_paste_tests.cut_copy_paste_tests_command().run_tests()
+
+def test_tests_neo():
+	assert cut_copy_paste_tests.cut_copy_paste_tests_command().run_tests_neo()
+
+def test_application_command():
+	sublime.run_command("cut_copy_paste_tests")
+	assert not sublime.active_window().views() # both suites passed and closed their buffers
+
+def test_instrumented_tests(capsys):
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_instrumentation", True)
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_slow_ms", 1e9)
+	assert cut_copy_paste_tests.cut_copy_paste_tests_command().run_tests()
+	ops = copy_edit.stats.ops
+	assert ops["copy"]["count"] and ops["cut"]["count"] and ops["paste"]["count"]
+	assert ops["paste"]["api_calls"] >= 2 * ops["paste"]["count"]
+	sublime.run_command("copy_edit_stats", {"reset": True})
+	assert "paste" in capsys.readouterr().out and not ops
+
+def test_line_index():
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "one\n\ntwo\nthree"})
+	points = list(range(view.size() + 1))
+	expected = [(view.line(p).begin(), view.line(p).end()) for p in points]
+	assert list(copy_edit.LineIndex.lines(view, points)) == expected
+	assert copy_edit.LineIndex.last.is_current(view)
+	view.run_command("append", {"characters": "\n"})
+	assert not copy_edit.LineIndex.last.is_current(view)
+	view.close()
+
+def test_async_clipboard():
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_async_clipboard", True)
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "a\nb\n"})
+	view.sel().add_all([sublime.Region(0, 1), sublime.Region(2, 3)])
+	view.run_command("copy_edit")
+	assert sublime.get_clipboard() == "" # not published yet
+	view.sel().clear()
+	view.sel().add(sublime.Region(4))
+	view.run_command("paste_edit") # publishes the copy first
+	assert sublime.get_clipboard() == "a\nb" and view.substr(sublime.Region(0, view.size())) == "a\nb\na\nb"
+	view.run_command("cut_edit")
+	sublime.run_timeouts()
+	assert sublime.get_clipboard() == "b\n" and sublime.last_status_message() == "Cut 2 characters"
+	view.close()
+
+def test_lazy_clipboard():
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_lazy_clipboard", True)
+	sublime.set_clipboard("elsewhere")
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "a\nb\n"})
+	view.sel().add_all([sublime.Region(0, 1), sublime.Region(2, 3)])
+	view.run_command("copy_edit")
+	assert sublime.get_clipboard() == "elsewhere" and sublime.last_status_message().startswith("Copied 2 characters")
+	view.sel().clear()
+	view.sel().add(sublime.Region(4))
+	view.run_command("paste_edit") # from selection_strings, without publishing
+	assert sublime.get_clipboard() == "elsewhere" and view.substr(sublime.Region(0, view.size())) == "a\nb\na\nb"
+	sublime_plugin.on_deactivated(view)
+	assert sublime.get_clipboard() == "a\nb"
+	view.sel().clear()
+	view.sel().add(sublime.Region(0, 2))
+	view.run_command("cut_edit")
+	assert sublime.get_clipboard() == "a\nb"
+	sublime.run_timeouts() # the idle timeout
+	assert sublime.get_clipboard() == "a\n" and copy_edit.paste_history[0] == "a\n"
+	view.close()
+
+def test_paste_from_history_pages():
+	settings = sublime.load_settings("Preferences.sublime-settings")
+	settings.set("paste_from_history_page_size", 4)
+	settings.set("copy_edit_history_size", 10)
+	for i in range(10):
+		copy_edit.add_string_to_paste_history("entry\t{0}\n".format(i))
+	window = sublime.active_window()
+	view = window.new_file()
+	view.sel().add(sublime.Region(0))
+	pages = []
+	def pick(items, on_select):
+		pages.append(items)
+		on_select(len(items) - 1 if len(pages) < 3 else 1)
+	window.on_panel = pick
+	view.run_command("paste_from_history_edit")
+	sublime.run_timeouts()
+	assert pages[0] == ["entry 9 ", "entry 8 ", "entry 7 ", "entry 6 ", "... 6 more"]
+	assert pages[2] == ["entry 1 ", "entry 0 "]
+	assert view.substr(sublime.Region(0, view.size())) == "entry\t0\n"
+
+	settings.erase("paste_from_history_page_size")
+	settings.set("copy_edit_history_size", 5000)
+	for i in range(5000):
+		copy_edit.add_string_to_paste_history("item {0}".format(i))
+	pages = []
+	window.on_panel = lambda items, on_select: pages.append(items)
+	view.run_command("paste_from_history_edit")
+	assert len(copy_edit.paste_history) == 5000
+	assert pages == [["item {0}".format(i) for i in range(4999, 4949, -1)] + ["... 4950 more"]]
+	view.close()
+
+def test_paste_from_history_search(monkeypatch):
+	settings = sublime.load_settings("Preferences.sublime-settings")
+	settings.set("copy_edit_history_size", 100)
+	for i in range(100):
+		copy_edit.add_string_to_paste_history("item {0} of list".format(i))
+	copy_edit.add_string_to_paste_history("List of items")
+	history = copy_edit.paste_history
+	assert [history.entries[k].text() for k in history.search("LIST")] == ["List of items"] + ["item {0} of list".format(i) for i in range(99, -1, -1)][:99]
+	assert [history.entries[k].text() for k in history.search("m 42 ")] == ["item 42 of list"]
+	assert history.search("no such text") == []
+	key = history.search("m 42 ")[0]
+	history.remove(key)
+	assert history.search("m 42 ") == [] and not any(key in keys for keys in history.index.postings.values())
+	window = sublime.active_window()
+	view = window.new_file()
+	view.sel().add(sublime.Region(0))
+	window.on_input = lambda caption, initial_text, on_done, on_change, on_cancel: on_done("em 7 ")
+	window.on_panel = lambda items, on_select: on_select(0)
+	view.run_command("paste_from_history_search")
+	assert view.substr(sublime.Region(0, view.size())) == "item 7 of list"
+	view.close()
+	monkeypatch.setattr(copy_edit.TrigramIndex, "max_chars", 1000)
+	monkeypatch.setattr(history, "compress_size", 1000)
+	large = "Large head " + "x" * 5000 + " tail"
+	history.add(large)
+	monkeypatch.setattr(copy_edit.zlib, "decompress", lambda data: pytest.fail("decompressed by a search"))
+	found = history.search("LARGE") # indexes the beginning of it
+	assert [history.entries[k].preview for k in found] == [large[:45] + "..."]
+	monkeypatch.setattr(copy_edit, "inflate_chunks", lambda data, chunk_size: pytest.fail("decompressed by a search"))
+	assert history.search("la")[0] == found[0] and history.search(" tail") == [] # only the beginning is searched
+	settings.set("copy_edit_history_size", 3)
+	copy_edit.configure_paste_history() # the oldest go at once
+	assert len(history) == 3 and len(history.index.trigrams) + len(history.index.pending) == 3
+
+def test_paste_from_history_keeps_selections():
+	view = sublime.active_window().new_file()
+	view.set_line_endings("Windows")
+	view.run_command("append", {"characters": "one\ntwo\n"})
+	view.sel().add_all([sublime.Region(0, 3), sublime.Region(5)])
+	view.run_command("copy_edit") # "one" and the whole line "two\n"
+	view.sel().clear()
+	view.sel().add(sublime.Region(1, 2))
+	view.run_command("copy_edit")
+	assert sublime.get_clipboard() == "n"
+	view.run_command("append", {"characters": "x\ny\n"})
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(8), sublime.Region(10)])
+	view.run_command("paste_from_history_idx", {"idx": 1})
+	assert sublime.get_clipboard() == "one\r\ntwo\r\n"
+	assert view.substr(sublime.Region(0, view.size())) == "one\ntwo\nonex\ntwo\ny\n"
+	view.close()
+
+def test_profile_next(tmpdir, capsys):
+	sublime.run_command("copy_edit_profile_next", {"count": 2, "directory": str(tmpdir)})
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "text"})
+	view.sel().add(sublime.Region(0, 4))
+	for command in ["copy_edit", "paste_edit", "paste_edit"]:
+		view.run_command(command)
+	assert sorted(f.basename.split("-")[0] for f in tmpdir.listdir()) == ["copy", "paste"]
+	out = capsys.readouterr().out
+	assert out.count("CopyEdit: profile of") == 2 and "copy_edit.py" in out
+	assert copy_edit.profiler.remaining == 0
+	view.close()
+
+def test_chunked_paste():
+	settings = sublime.load_settings("Preferences.sublime-settings")
+	def paste(chunked):
+		settings.set("copy_edit_chunked_paste_size", 10 if chunked else 0)
+		settings.set("copy_edit_paste_chunk_size", 4)
+		view = sublime.active_window().new_file()
+		view.run_command("append", {"characters": "0123456789\nabc\ndef\n"})
+		view.sel().add_all([sublime.Region(0, 10), sublime.Region(11), sublime.Region(15, 16)])
+		view.run_command("copy_edit") # "0123456789", the line "abc\n" and "d"
+		view.sel().clear()
+		view.sel().add_all([sublime.Region(11, 12), sublime.Region(17), sublime.Region(19)])
+		view.run_command("paste_edit")
+		return view
+	expected = paste(False)
+	view = paste(True)
+	assert view.substr(sublime.Region(0, view.size())) == "0123456789\nabc\ndef\n" # nothing yet
+	sublime.run_timeouts()
+	assert view.substr(sublime.Region(0, view.size())) == expected.substr(sublime.Region(0, expected.size()))
+	assert list(view.sel()) == list(expected.sel())
+	assert sublime.last_status_message() == "Pasted 15 characters over 3 selection regions"
+	assert not view.is_read_only()
+
+	def undo(command):
+		name, args = sublime_plugin.on_text_command(view.id(), command, None)
+		view.run_command(name or command, args)
+		sublime.run_timeouts()
+	pasted = view.substr(sublime.Region(0, view.size()))
+	undo("undo") # all the chunks at once
+	assert view.substr(sublime.Region(0, view.size())) == "0123456789\nabc\ndef\n"
+	undo("redo")
+	assert view.substr(sublime.Region(0, view.size())) == pasted
+	undo("undo")
+	undo("redo")
+	assert view.substr(sublime.Region(0, view.size())) == pasted
+
+	before = view.substr(sublime.Region(0, view.size()))
+	view.sel().clear()
+	view.sel().add(sublime.Region(0))
+	view.run_command("paste_edit")
+	sublime._timeouts.pop(0)() # one chunk
+	assert view.substr(sublime.Region(0, view.size())) != before
+	assert view.is_read_only()
+	view.run_command("append", {"characters": "x"}) # ignored while pasting
+	view.run_command("cancel_paste_edit")
+	sublime.run_timeouts()
+	assert view.substr(sublime.Region(0, view.size())) == before
+	assert sublime.last_status_message() == "Paste cancelled"
+	assert not view.is_read_only()
+
+	view.run_command("paste_edit")
+	sublime._timeouts.pop(0)()
+	view.set_read_only(False) # like a reload of the file, which ignores read-only
+	view.run_command("append", {"characters": "x"})
+	sublime.run_timeouts()
+	assert sublime.last_status_message().startswith("Paste stopped because the buffer was changed")
+	assert not view.is_read_only() and copy_edit.ChunkedPaste.running == {}
+
+def test_dense_paste(monkeypatch):
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": ("x" * 100 + ",") * 20})
+	view.sel().add(sublime.Region(0, 1))
+	view.run_command("copy_edit")
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(i * 101, i * 101 + 100) for i in range(20)])
+	read = []
+	substr = view.substr
+	def counting_substr(region):
+		read.append(region.size())
+		return substr(region)
+	monkeypatch.setattr(view, "substr", counting_substr)
+	view.run_command("paste_edit")
+	monkeypatch.undo()
+	assert view.substr(sublime.Region(0, view.size())) == "x," * 20
+	assert sum(read) == 19 # just the commas between the selections
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(i * 2) for i in range(20)]) # carets: no text replaced
+	read = []
+	monkeypatch.setattr(view, "substr", counting_substr)
+	view.run_command("paste_edit")
+	monkeypatch.undo()
+	assert view.substr(sublime.Region(0, view.size())) == "xx," * 20
+	assert len(read) == 1 # all the gaps at once
+	view.close()
+
+def test_paste_template():
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "ab\n" * 3})
+	view.sel().add_all([sublime.Region(0, 1), sublime.Region(3, 4)])
+	view.run_command("copy_edit") # "a" twice, kept once
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(1), sublime.Region(4, 5), sublime.Region(7, 8)])
+	view.run_command("paste_template_edit", {"template": "[{n:02}{color}{text}{sel}]", "start": 9, "step": 2, "lists": {"color": ["R", "G"]}})
+	assert view.substr(sublime.Region(0, view.size())) == "a[09Ra]b\na[11Gab]\na[13Rab]\n"
+	assert [r.a for r in view.sel()] == [7, 17, 26]
+	assert sublime.last_status_message() == "Pasted 20 characters over 3 selection regions"
+	for template in ["{missing}", "{text.x}", "{i[0]}"]:
+		view.run_command("paste_template_edit", {"template": template})
+		assert view.size() == 27 and sublime.last_status_message().startswith("Bad paste template")
+	sublime.set_clipboard("c") # copied in another application
+	view.sel().clear()
+	view.sel().add(sublime.Region(0))
+	view.run_command("paste_template_edit", {"template": "{text}{i}"})
+	assert view.substr(sublime.Region(0, 3)) == "c0a"
+	assert copy_edit.paste_history[0] == "c" and copy_edit.clipboard_is_remembered("c")
+	view.close()
+
+def test_paste_template_distributes_like_paste():
+	def paste(command, carets, args = None):
+		view = sublime.active_window().new_file()
+		view.run_command("append", {"characters": "a\nb\nc\nd\n\n\n"})
+		view.sel().add_all([sublime.Region(0, 1), sublime.Region(2, 3), sublime.Region(4, 5), sublime.Region(6, 7)])
+		view.run_command("copy_edit")
+		view.sel().clear()
+		view.sel().add_all([sublime.Region(caret) for caret in carets])
+		view.run_command(command, args)
+		text = view.substr(sublime.Region(8, view.size()))
+		view.close()
+		return text
+	for carets in [[8, 9], [8]]: # two strings each, all four joined
+		assert paste("paste_template_edit", carets, {"template": "{text}"}) == paste("paste_edit", carets)
+	assert paste("paste_template_edit", [8, 9], {"template": "<{text}>"}) == "<ab>\n<cd>\n"
+
+def test_shared_history(tmpdir, monkeypatch):
+	monkeypatch.setattr(sublime, "cache_path", lambda: str(tmpdir))
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_shared_history", True)
+	other = copy_edit.SharedHistory(str(tmpdir.join("CopyEdit", "shared_history.ring")), 1 << 16) # another Sublime instance
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "one\ntwo\n"})
+	view.sel().add_all([sublime.Region(0, 3), sublime.Region(5)])
+	view.run_command("copy_edit")
+	assert other.read() == [("one\ntwo\n", copy_edit.segments_of([("one", False), ("two\n", True)], "\n"))]
+	other.append("x\ny", copy_edit.segments_of([("x", False), ("y", False)], "\n"))
+	sublime.set_clipboard("x\ny") # copied in the other instance
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(0), sublime.Region(4)])
+	view.run_command("paste_edit")
+	assert view.substr(sublime.Region(0, view.size())) == "xone\nytwo\n"
+	other.append("z")
+	items = []
+	def pick(entries, on_select):
+		items.extend(entries)
+		on_select(1)
+	view.window().on_panel = pick
+	view.run_command("paste_from_history_edit")
+	assert items == ["x y", "z", "one two "] and sublime.get_clipboard() == "z"
+	assert [string for string, segments in other.read()] == ["x\ny", "z"] # both were pasted here, so they go to the front everywhere
+	other.close()
+	view.close()
+
+def test_shared_history_wraps(tmpdir):
+	path = str(tmpdir.join("ring"))
+	writer = copy_edit.SharedHistory(path, 256)
+	reader = copy_edit.SharedHistory(path, 256)
+	strings = ["string {0} ".format(i) * (i % 4 + 1) for i in range(40)]
+	read = []
+	for i, string in enumerate(strings):
+		writer.append(string)
+		if i % 3 == 0:
+			read.extend(s for s, segments in reader.read())
+	assert read == [s for s in strings if s in read] and read[-1] == strings[-1]
+	assert len(read) > 25 # only the ones overwritten before a read are lost
+	late = copy_edit.SharedHistory(path, 1 << 20) # the file keeps its size
+	kept = [s for s, segments in late.read()]
+	assert late.capacity == 256 and kept and kept == strings[-len(kept):]
+	writer.append("x" * 100) # larger than a quarter of the buffer
+	writer.append("\U0001F600" * 55) # so is this in UTF-8
+	assert reader.read() == []
+	for h in (writer, reader, late):
+		h.close()
+
+def test_shared_history_damaged(tmpdir):
+	path = str(tmpdir.join("ring"))
+	writer = copy_edit.SharedHistory(path, 256)
+	reader = copy_edit.SharedHistory(path, 256)
+	for i in range(8):
+		writer.append("string {0}".format(i))
+	magic, capacity, head, tail = writer.header.unpack_from(writer.map)
+	offset = writer.header.size + tail % capacity
+	writer.map[offset:offset + 4] = b"\0" * 4 # a record of size 0
+	assert reader.read() == [] # skipped to the head
+	for i in range(8, 16):
+		writer.append("string {0}".format(i))
+	assert [s for s, segments in reader.read()] == ["string {0}".format(i) for i in range(8, 16)]
+	writer.close()
+	reader.close()
+
+def restart_history():
+	# What paste history goes through when Sublime is restarted.
+	copy_edit.plugin_unloaded()
+	copy_edit.paste_history.log = None
+	copy_edit.configure_paste_history()
+
+def test_history_log(tmpdir, monkeypatch):
+	monkeypatch.setattr(sublime, "cache_path", lambda: str(tmpdir))
+	settings = sublime.load_settings("Preferences.sublime-settings")
+	settings.set("copy_edit_persist_history", True)
+	settings.set("copy_edit_history_compress_size", 1000)
+	large = "".join("line {0}\n".format(i) for i in range(1000))
+	for string in ["one", large, "two"]:
+		copy_edit.add_string_to_paste_history(string)
+	copy_edit.add_string_to_paste_history("one") # to the front
+	restart_history()
+	copy_edit.add_string_to_paste_history("three")
+	copy_edit.paste_history.load()
+	assert [e.text() for e in copy_edit.paste_history] == ["three", "one", "two", large]
+	entry = list(copy_edit.paste_history)[3]
+	assert entry.string is None and entry.packed is not None and entry.preview == "line 0 line 1 line 2 line 3 line 4 line 5 lin..."
+
+	path = str(tmpdir.join("CopyEdit", "paste_history.log"))
+	restart_history()
+	size = os.path.getsize(path)
+	with open(path, "ab") as f:
+		f.write(b"A\0\0\0\x10tor") # a record cut short by a crash
+	copy_edit.paste_history.load()
+	assert [e.text() for e in copy_edit.paste_history] == ["three", "one", "two", large]
+	assert os.path.getsize(path) == size and copy_edit.paste_history.log.records == 5
+	copy_edit.paste_history.log.compact_file(3) # keeps what replaying into 3 entries keeps
+	restart_history()
+	copy_edit.paste_history.load()
+	assert [e.text() for e in copy_edit.paste_history] == ["three", "one", "two"]
+	assert copy_edit.paste_history.log.records == 3
+
+def test_history_log_compacts_without_load(tmpdir, monkeypatch):
+	monkeypatch.setattr(sublime, "cache_path", lambda: str(tmpdir))
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_persist_history", True)
+	copying = [False]
+	def off_the_copy_path(name):
+		method = getattr(copy_edit.HistoryLog, name)
+		def call(self, *args):
+			assert not copying[0], name + " ran during a copy"
+			return method(self, *args)
+		monkeypatch.setattr(copy_edit.HistoryLog, name, call)
+	for name in ["read", "flush", "count", "scan"]:
+		off_the_copy_path(name)
+	for session in range(3): # paste history is never opened
+		for i in range(100):
+			copying[0] = True
+			copy_edit.add_string_to_paste_history("{0} {1}".format(session, i))
+			copying[0] = False
+			if i % 30 == 0:
+				sublime.run_timeouts() # the async thread writes the log
+		restart_history()
+	limit = 4 * copy_edit.paste_history.maxlen + 16
+	assert copy_edit.paste_history.log.records <= limit
+	assert len(list(copy_edit.paste_history.log.scan())) <= limit
+	copy_edit.paste_history.load()
+	assert [e.text() for e in copy_edit.paste_history] == ["2 {0}".format(i) for i in range(99, 84, -1)]
+
+def delete(view, command_name, times = 1):
+	for _ in range(times): # the editor asks the listeners first
+		sublime_plugin.on_text_command(view.id(), command_name, {})
+		view.run_command(command_name)
+
+def test_deleted_text():
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "one two\nsix ten\n"})
+	view.sel().add_all([sublime.Region(7), sublime.Region(15)])
+	delete(view, "left_delete", 3) # backspacing over "two" and "ten" at both carets
+	assert len(copy_edit.paste_history) == 0 # not before the run ends
+	sublime.run_timeouts()
+	assert copy_edit.paste_history[0] == "two\nten"
+
+	view.sel().clear()
+	view.sel().add(sublime.Region(2))
+	delete(view, "right_delete", 2) # "e " right of the caret
+	delete(view, "left_delete")     # and "n" left of it, in the same run
+	assert view.substr(sublime.Region(0, view.size())) == "o\nsix \n"
+	view.sel().clear()
+	view.sel().add(sublime.Region(3))
+	sublime_plugin.on_text_command(view.id(), "copy", {}) # any other command ends the run
+	view.run_command("copy_edit")
+	assert [e.text() for e in copy_edit.paste_history] == ["six \n", "ne ", "two\nten"]
+
+	view.sel().clear()
+	view.sel().add(sublime.Region(1))
+	delete(view, "left_delete") # a single character is dropped
+	view.sel().clear()
+	view.sel().add(sublime.Region(1, 3))
+	delete(view, "right_delete") # a new run: the caret isn't where the last delete left it
+	sublime.run_timeouts()
+	assert [e.text() for e in copy_edit.paste_history] == ["si", "six \n", "ne ", "two\nten"]
+	view.close()
+
+def test_history_across_threads():
+	# Copies and deletes go to history from the async thread while the UI thread searches and pages it.
+	history = copy_edit.paste_history
+	sublime.load_settings("Preferences.sublime-settings").set("copy_edit_history_size", 200)
+	copy_edit.configure_paste_history()
+	def copy():
+		for i in range(3000):
+			copy_edit.remember_clipboard("entry {0} of many".format(i))
+	thread = threading.Thread(target = copy)
+	thread.start()
+	while thread.is_alive():
+		history.search("ntry")
+		history.page(0, 50)
+		copy_edit.clipboard_is_remembered("entry 1 of many")
+	thread.join()
+	assert len(history) == 200 and len(history.search("of many", limit = 1000)) == 200
+	assert set(history.index.trigrams) == set(history.entries)
+
+def test_selection_strings():
+	a, b, c = ("a", False), ("b\n", True), ("c", False)
+	for strings, form in [([a, b, c], "unique"), ([a] * 5 + [b] * 5 + [a], "runs"), ([a, b, a, c, a, b], "indices")]:
+		stored = copy_edit.SelectionStrings(strings)
+		assert ("indices" if stored.indices is not None else "runs" if stored.runs is not None else "unique") == form
+		assert stored == strings and len(stored) == len(strings) and stored.chars == sum(len(s[0]) for s in strings)
+		assert [stored[i] for i in range(len(strings))] == strings and stored[-1] == strings[-1]
+		assert len(stored.unique) == len(set(strings)) and not hasattr(stored, "ids")
+		stored.append(b)
+		stored.extend([c, c])
+		assert stored == strings + [b, c, c] and len(stored.unique) == len(set(strings + [c]))
+		assert stored.bytes == sum(sys.getsizeof(s[0]) for s in stored.unique)
+	distinct = copy_edit.SelectionStrings(("{0}".format(i), False) for i in range(1000))
+	assert distinct.indices is None and distinct.runs is None and distinct[999] == ("999", False)
+
+def test_clipboard_text():
+	strings = [("a\nb", False), ("c\n", True), ("", False)]
+	assert copy_edit.clipboard_text(strings, "\n") == "a\nb\nc\n\n"
+	assert copy_edit.clipboard_text(strings, "\r\n") == "a\r\nb\r\nc\r\n\r\n"
+	assert copy_edit.clipboard_text(strings, "\r") == "a\rb\rc\r\r"
+	large = "x" * 100
+	assert copy_edit.clipboard_text([(large, False)], "\n") is large # shared, not copied
+
+def test_history_entry_streams(monkeypatch):
+	monkeypatch.setattr(copy_edit, "utf8_chunks", lambda string, chunk_size = 1000: (string[i:i + chunk_size].encode("utf-8", "surrogatepass") for i in range(0, len(string), chunk_size)))
+	string = "".join("{0} é\U0001F600\n".format(i) for i in range(2000))
+	kept = copy_edit.HistoryEntry(string, 1000, 1 << 20)
+	spilled = copy_edit.HistoryEntry(string, 1000, 2000)
+	for entry in (kept, spilled):
+		assert entry.string is None and entry.text() == string and entry.length == len(string)
+		assert entry.get_digest() == hashlib.sha1(string.encode("utf-8")).digest()
+	assert kept.packed is not None and kept.path is None
+	assert spilled.packed is None and os.path.getsize(spilled.path) == len(zlib.compress(string.encode("utf-8"), 1))
+	path = spilled.path
+	spilled.discard()
+	assert not os.path.exists(path)
+	unpacked = copy_edit.HistoryEntry.unpack(kept.packed, 1 << 20)
+	assert (unpacked.text(), unpacked.length, unpacked.get_digest(), unpacked.preview) == (string, kept.length, kept.digest, kept.preview)
+
+	history = copy_edit.PasteHistory(15, compress_size = 1000)
+	key = history.add(string)
+	assert history.add(string[:-1] + "\n") == key and len(history) == 1 # found by length and digest
@@ -0,0 +1,21 @@
+import os, sys, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fuzz"))
+
+import copy_edit, fuzz_paste
+
+def test_small_sweep(capsys):
+	assert fuzz_paste.main(["--cases", "500", "--jobs", "1", "--chunk", "250"]) == 0
+	assert "500 cases, 0 distinct minimized failures" in capsys.readouterr().out
+
+def test_pool_sweep(capsys):
+	assert fuzz_paste.main(["--cases", "200", "--jobs", "2", "--chunk", "100"]) == 0
+
+def test_minimize():
+	def broken_paste(view, edit, strings): # drops the whole-line flag
+		fuzz_paste.plugin_paste(view, edit, [(s, False) for s, whole_line in strings])
+	still_fails = lambda case: fuzz_paste.fails(case, broken_paste)
+	rng = random.Random(1)
+	case = next(case for case in iter(lambda: fuzz_paste.random_case(rng), None) if still_fails(case))
+	text, regions, strings = fuzz_paste.minimize(case, still_fails)
+	assert len(regions) == 1 and strings == [("\n", True)] and text in ("a", "b", "\n")
@@ -0,0 +1,51 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import sublime, copy_edit, replay_trace
+
+def record(tmpdir, with_text):
+	path = str(tmpdir.join("trace.jsonl"))
+	settings = sublime.load_settings("Preferences.sublime-settings")
+	settings.set("copy_edit_trace", True)
+	settings.set("copy_edit_trace_path", path)
+	settings.set("copy_edit_trace_text", with_text)
+	view = sublime.active_window().new_file()
+	view.run_command("append", {"characters": "one two\nthree\nfour\n"})
+	view.sel().add_all([sublime.Region(0, 3), sublime.Region(10)])
+	view.run_command("copy_edit")
+	view.sel().clear()
+	view.sel().add_all([sublime.Region(4, 7), sublime.Region(19)])
+	view.run_command("paste_edit")
+	view.run_command("paste_from_history_idx", {"idx": 0})
+	copy_edit.LineIndex.last = None
+	view.run_command("paste_template_edit", {"template": "<{text}>", "start": 5})
+	assert copy_edit.LineIndex.last is None # the lines tracing looked up are not left for the operation
+	result = view.substr(sublime.Region(0, view.size()))
+	view.close()
+	settings.set("copy_edit_trace", False)
+	return path, result
+
+def test_trace_without_text(tmpdir):
+	path, result = record(tmpdir, False)
+	entries = replay_trace.load(path)
+	assert [e["op"] for e in entries] == ["copy", "paste", "paste_from_history", "paste_template"]
+	assert entries[3]["args"] == {"start": 5} # the template is text
+	assert entries[0]["sel"] == [0, 3, 0, 4, 7, 0, 2, 3] and entries[0]["seg"] == [3, 6] and entries[0]["wl"] == [1]
+	assert "text" not in entries[0] and "strings" not in entries[0]
+	text = replay_trace.buffer_text(entries[0], {})
+	assert len(text) == entries[0]["size"] and text[7] == text[13] == "\n"
+	totals, times = replay_trace.replay(entries)
+	assert [count for recorded, replayed, count in totals.values()] == [1, 1, 1, 1] and len(times) == 4
+
+def test_trace_with_text(tmpdir):
+	path, result = record(tmpdir, True)
+	entries = replay_trace.load(path)
+	assert entries[0]["text"] == "one two\nthree\nfour\n" and entries[1]["strings"] == ["one", "three\n"]
+	assert entries[3]["args"] == {"template": "<{text}>", "start": 5}
+	texts = {}
+	replay_trace.buffer_text(entries[0], texts) # the paste's buffer is the one recorded with the copy
+	run, view = replay_trace.setup(entries[1], texts)
+	run()
+	assert view.substr(sublime.Region(0, view.size())) == "one one\nthree\nfour\nthree\n"
+	assert replay_trace.main([path]) == 0